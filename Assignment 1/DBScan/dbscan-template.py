@@ -1,41 +1,359 @@
 import sys
 import os
+import time
+import itertools
+import subprocess
+import collections
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
-from sklearn.cluster import DBSCAN
-from sklearn import metrics
-from sklearn.datasets.samples_generator import make_blobs
-from sklearn.preprocessing import StandardScaler
-import matplotlib.pyplot as plt
+NPY_MAGIC = b'\x93NUMPY'
+# seconds from launching the script to reaching main, measured by measure_startup
+STARTUP_BUDGET = 0.5
+MAX_PLOT_POINTS = 100000
 
 
 def read_data(filepath):
 	'''Read data points from file specified by filepath
 	Args:
-		filepath (str): the path to the file to be read
+		filepath (str): the path to the file to be read, either comma separated text with one point per line or a .npy file as written by convert_data
 
 	Returns:
-		numpy.ndarray: a numpy ndarray with shape (n, d) where n is the number of data points and d is the dimension of the data points
+		numpy.ndarray: a numpy ndarray with shape (n, d) where n is the number of data points and d is the dimension of the data points. A float64 .npy file is memory-mapped read-only, without copying it.
 
 	'''
 
-	X = []
-	with open(filepath, 'r') as f:
-		lines = f.readlines()
-		for line in lines:
-			X.append([float(e) for e in line.strip().split(',')])
-	return np.array(X)
+	with open(filepath, 'rb') as f:
+		is_npy = f.read(len(NPY_MAGIC)) == NPY_MAGIC
+	if is_npy:
+		X = np.load(filepath, mmap_mode='r')
+		if X.dtype != np.float64:
+			X = X.astype(np.float64)
+		return X.reshape(len(X), -1)
+	# numpy parses the text in C, to the same floats as float()
+	return np.loadtxt(filepath, delimiter=',', dtype=np.float64, ndmin=2)
 
 
+def convert_data(text_filepath, npy_filepath):
+	'''Convert a comma separated data file to a .npy file, which read_data loads without parsing
+	Args:
+		text_filepath (str): the path to the text file to be read
+		npy_filepath (str): the path to the .npy file to be written
+	'''
+	np.save(npy_filepath, read_data(text_filepath))
+
+
+def write_lines(filepath, values):
+	'''Write one value per line, in a single write
+	Args:
+		filepath (str): the path to the file to be written
+		values (numpy.ndarray or list): the values, written as str writes them
+	'''
+	values = values.tolist() if isinstance(values, np.ndarray) else values
+	with open(filepath, 'w') as f:
+		if len(values):
+			f.write('\n'.join(map(str, values)) + '\n')
+
+
+class BruteIndex(object):
+	'''
+	Region queries by measuring the distance to every point, O(n) per query.
+	'''
+	def __init__(self, X, eps):
+		self.X = X
+		self.eps = eps
+
+	def query(self, x):
+		'''
+		:param x: a point
+		:return: sorted indexes of the points within eps of x
+		'''
+		return self.within(x, np.arange(len(self.X)))
+
+	def within(self, x, candidates):
+		'''
+		:param candidates: sorted indexes of the points that may be within eps of x
+		:return: the candidates within eps of x, measured exactly as getNeighbours does
+		'''
+		distances = np.linalg.norm(x - self.X[candidates], axis=1)
+		return candidates[distances <= self.eps]
+
+	def candidate_blocks(self):
+		'''
+		:return: generator of (rows, candidates) pairs of sorted index arrays, every row
+		once, with the candidates holding every neighbour of each of the rows
+		'''
+		yield np.arange(len(self.X)), np.arange(len(self.X))
+
+
+class GridIndex(BruteIndex):
+	'''
+	Uniform grid of cells slightly wider than eps: every neighbour of a point lies in
+	its own cell or an adjacent one, so a query only measures the points of 3^d cells.
+	Meant for low dimensions.
+	'''
+	def __init__(self, X, eps):
+		BruteIndex.__init__(self, X, eps)
+		# the margin keeps neighbours at exactly eps within adjacent cells despite rounding
+		self.size = eps * (1 + 1e-6) if eps > 0 else 1.0
+		cells = np.floor(X / self.size).astype(np.int64)
+		# points sorted by cell, each cell a slice of the order
+		self.order = np.lexsort(cells.T[::-1])
+		sorted_cells = cells[self.order]
+		bounds = np.flatnonzero(np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)) + 1
+		starts = np.concatenate(([0], bounds)).astype(np.intp)
+		ends = np.concatenate((bounds, [len(X)])).astype(np.intp)
+		self.cells = {tuple(cell): (start, end) for cell, start, end in zip(sorted_cells[starts].tolist(), starts, ends)}
+		self.offsets = np.array(list(itertools.product([-1, 0, 1], repeat=X.shape[1])), dtype=np.int64)
+
+	def query(self, x):
+		cell = np.floor(x / self.size).astype(np.int64)
+		candidates = []
+		for neighbour in (cell + self.offsets).tolist():
+			bounds = self.cells.get(tuple(neighbour))
+			if bounds is not None:
+				candidates.append(self.order[bounds[0]:bounds[1]])
+		if not candidates:
+			return np.empty(0, dtype=np.intp)
+		return self.within(x, np.sort(np.concatenate(candidates)))
+
+	def candidate_blocks(self):
+		# the points of a cell share the points of its adjacent cells as candidates
+		for cell, (start, end) in self.cells.items():
+			candidates = []
+			for neighbour in (np.array(cell) + self.offsets).tolist():
+				bounds = self.cells.get(tuple(neighbour))
+				if bounds is not None:
+					candidates.append(self.order[bounds[0]:bounds[1]])
+			yield self.order[start:end], np.sort(np.concatenate(candidates))
+
+
+class KDTreeIndex(BruteIndex):
+	'''
+	KD-tree over buckets of at most leaf_size points, split at the median of the widest
+	dimension. A query descends into every node whose bounding box comes within eps.
+	'''
+	def __init__(self, X, eps, leaf_size=32):
+		BruteIndex.__init__(self, X, eps)
+		self.order = np.arange(len(X))
+		# per node: slice of the order, children (-1 for a leaf) and bounding box
+		self.start, self.end, self.left, self.right, self.lower, self.upper = [], [], [], [], [], []
+		stack = [(0, len(X), None, None)]
+		while stack:
+			start, end, parent, side = stack.pop()
+			node = len(self.start)
+			if parent is not None:
+				side[parent] = node
+			points = X[self.order[start:end]]
+			self.start.append(start)
+			self.end.append(end)
+			self.left.append(-1)
+			self.right.append(-1)
+			self.lower.append(points.min(axis=0) if len(points) else np.zeros(X.shape[1]))
+			self.upper.append(points.max(axis=0) if len(points) else np.zeros(X.shape[1]))
+			if end - start > leaf_size:
+				dimension = np.argmax(self.upper[node] - self.lower[node])
+				if self.upper[node][dimension] > self.lower[node][dimension]:
+					mid = (start + end) // 2
+					segment = self.order[start:end]
+					segment[:] = segment[np.argpartition(points[:, dimension], mid - start)]
+					stack.append((start, mid, node, self.left))
+					stack.append((mid, end, node, self.right))
+		self.lower, self.upper = np.array(self.lower), np.array(self.upper)
+		# pruning is conservative, the exact test happens on the candidates
+		self.reach = eps * (1 + 1e-6)
+
+	def query(self, x):
+		candidates = []
+		stack = [0]
+		while stack:
+			node = stack.pop()
+			gap = np.maximum(self.lower[node] - x, 0) + np.maximum(x - self.upper[node], 0)
+			if np.sqrt(np.dot(gap, gap)) > self.reach:
+				continue
+			if self.left[node] < 0:
+				candidates.append(self.order[self.start[node]:self.end[node]])
+			else:
+				stack.append(self.left[node])
+				stack.append(self.right[node])
+		if not candidates:
+			return np.empty(0, dtype=np.intp)
+		return self.within(x, np.sort(np.concatenate(candidates)))
+
+	def candidate_blocks(self):
+		# the points of a leaf share the leaves whose boxes come within eps of its box
+		for leaf in np.flatnonzero(np.array(self.left) < 0):
+			candidates = []
+			stack = [0]
+			while stack:
+				node = stack.pop()
+				gap = np.maximum(self.lower[node] - self.upper[leaf], 0) + np.maximum(self.lower[leaf] - self.upper[node], 0)
+				if np.sqrt(np.dot(gap, gap)) > self.reach:
+					continue
+				if self.left[node] < 0:
+					candidates.append(self.order[self.start[node]:self.end[node]])
+				else:
+					stack.append(self.left[node])
+					stack.append(self.right[node])
+			yield np.sort(self.order[self.start[leaf]:self.end[leaf]]), np.sort(np.concatenate(candidates))
+
+
+def neighbour_pairs(X, eps, neighbour_index, block_size=2 ** 22):
+	'''
+	Find every pair of points within eps of each other, in both orders and with every point
+	paired with itself.
+	:param X: input X
+	:param eps: eps
+	:param neighbour_index: index giving the candidate blocks, see build_index
+	:param block_size: the most distance components computed at once, which bounds memory
+	:return: rows, columns, distances
+	'''
+	rows, columns, pair_distances = [], [], []
+	for block_rows, candidates in neighbour_index.candidate_blocks():
+		step = max(1, block_size // max(1, len(candidates) * X.shape[1]))
+		points = X[candidates]
+		for start in range(0, len(block_rows), step):
+			sub_rows = block_rows[start:start + step]
+			# the same norm as getNeighbours, one row of the block per point
+			distances = np.linalg.norm(X[sub_rows][:, np.newaxis, :] - points[np.newaxis, :, :], axis=2)
+			i, j = np.nonzero(distances <= eps)
+			rows.append(sub_rows[i])
+			columns.append(candidates[j])
+			pair_distances.append(distances[i, j])
+	if not rows:
+		return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+	return np.concatenate(rows), np.concatenate(columns), np.concatenate(pair_distances)
+
+
+def neighbour_graph(X, eps, neighbour_index, block_size=2 ** 22):
+	'''
+	Compute every eps-neighbourhood once, as a CSR graph: the neighbours of point i are
+	indices[indptr[i]:indptr[i + 1]] in increasing order, including i itself.
+	:param X: input X
+	:param eps: eps
+	:param neighbour_index: index giving the candidate blocks, see build_index
+	:param block_size: the most distance components computed at once, which bounds memory
+	:return: indptr, indices
+	'''
+	rows, columns, _ = neighbour_pairs(X, eps, neighbour_index, block_size)
+	order = np.lexsort((columns, rows))
+	indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(X)))))
+	return indptr, columns[order]
+
+
+def count_neighbours(X, eps, rows, candidates, block_size=2 ** 22):
+	'''
+	Count the candidates within eps of each row, from blocks of squared distances
+	|x|^2 + |y|^2 - 2 x.y computed by matrix products. The few pairs whose squared
+	distance is too close to eps^2 to trust the expansion are measured exactly the way
+	getNeighbours measures them, so the counts match isCorePoint.
+	:param rows: indexes of the points to count for
+	:param candidates: indexes of the points that may be their neighbours
+	:param block_size: the most pairs held at once, which bounds memory
+	:return: neighbour count of every row, type: numpy array
+	'''
+	counts = np.zeros(len(rows), dtype=np.int64)
+	points = X[candidates]
+	squares = np.einsum('ij,ij->i', points, points)
+	step = max(1, block_size // max(1, len(candidates)))
+	for start in range(0, len(rows), step):
+		block = X[rows[start:start + step]]
+		block_squares = np.einsum('ij,ij->i', block, block)
+		scale = block_squares[:, np.newaxis] + squares[np.newaxis, :]
+		distances = scale - 2 * np.dot(block, points.T) - eps * eps
+		slack = 1e-9 * (scale + eps * eps)
+		i, j = np.nonzero(np.abs(distances) <= slack)
+		exact = np.linalg.norm(block[i] - points[j], axis=1) <= eps
+		counts[start:start + len(block)] = np.count_nonzero(distances < -slack, axis=1) + \
+		                                   np.bincount(i[exact], minlength=len(block))
+	return counts
+
+
+SHARED = {}
+
+
+def attach_shared(name, shape, dtype):
+	# process pool initializer: map X from shared memory instead of pickling it to every worker
+	SHARED['memory'] = shared_memory.SharedMemory(name=name)
+	SHARED['X'] = np.ndarray(shape, dtype=dtype, buffer=SHARED['memory'].buf)
+
+
+def count_shared(eps, tasks, block_size):
+	return [count_neighbours(SHARED['X'], eps, rows, candidates, block_size) for rows, candidates in tasks]
+
+
+def core_point_counts(X, eps, neighbour_index, n_jobs=1, block_size=2 ** 22):
+	'''
+	Neighbour count of every point, the candidate blocks of the index split into tasks
+	of about block_size pairs that n_jobs processes count over X in shared memory.
+	:param n_jobs: number of processes, -1 for every core, 1 counts in this process
+	:return: neighbour count of every point, type: numpy array
+	'''
+	X = np.ascontiguousarray(X, dtype=float)
+	counts = np.zeros(len(X), dtype=np.int64)
+	if n_jobs == -1:
+		n_jobs = os.cpu_count() or 1
+	if n_jobs <= 1:
+		for rows, candidates in neighbour_index.candidate_blocks():
+			counts[rows] = count_neighbours(X, eps, rows, candidates, block_size)
+		return counts
+
+	# split large blocks and group small ones so every task is worth sending
+	task_rows = max(1, (len(X) + 4 * n_jobs - 1) // (4 * n_jobs))
+	tasks, task, work = [], [], 0
+	for rows, candidates in neighbour_index.candidate_blocks():
+		for start in range(0, len(rows), task_rows):
+			task.append((rows[start:start + task_rows], candidates))
+			work += len(task[-1][0]) * len(candidates)
+			if work >= block_size:
+				tasks.append(task)
+				task, work = [], 0
+	if task:
+		tasks.append(task)
+
+	memory = shared_memory.SharedMemory(create=True, size=max(1, X.nbytes))
+	try:
+		shared = np.ndarray(X.shape, dtype=X.dtype, buffer=memory.buf)
+		shared[:] = X
+		with ProcessPoolExecutor(n_jobs, initializer=attach_shared, initargs=(memory.name, X.shape, X.dtype.str)) as pool:
+			futures = [pool.submit(count_shared, eps, task, block_size) for task in tasks]
+			for task, future in zip(tasks, futures):
+				for (rows, _), task_counts in zip(task, future.result()):
+					counts[rows] = task_counts
+		del shared
+	finally:
+		memory.close()
+		memory.unlink()
+	return counts
+
+
+def build_index(X, eps, index='auto'):
+	'''
+	:param X: input X
+	:param eps: eps
+	:param index: 'grid', 'kdtree', 'brute', or 'auto' for a grid up to 3 dimensions and a KD-tree above
+	:return: a neighbour index answering the region queries of dbscan
+	'''
+	if index == 'auto':
+		index = 'grid' if X.shape[1] <= 3 else 'kdtree'
+	indexes = {'grid': GridIndex, 'kdtree': KDTreeIndex, 'brute': BruteIndex}
+	if index not in indexes:
+		raise ValueError("unknown index %r, expected one of auto, grid, kdtree, brute" % (index,))
+	return indexes[index](X, eps)
+
 
 # To be implemented
-def dbscan(X, eps, minpts):
+def dbscan(X, eps, minpts, index='auto', graph=False, n_jobs=None):
 	'''dbscan function for clustering
 	Args:
 		X (numpy.ndarray): a numpy array of points with dimension (n, d) where n is the number of points and d is the dimension of the data points
 		eps (float): eps specifies the maximum distance between two samples for them to be considered as in the same neighborhood
 		minpts (int): minpts is the number of samples in a neighborhood for a point to be considered as a core point. This includes the point itself.
+		index (str): the neighbour index answering region queries, see build_index. All of them find the same neighbours, so the result does not depend on it.
+		graph (bool): compute every neighbourhood once, in blocks, into a neighbour graph that both core detection and cluster expansion read, instead of querying the index twice per point. The graph holds every neighbour pair, so it needs memory for them.
+		n_jobs (int): when set, core points are found by counting neighbours in blocks of matrix products, over this many processes (-1 for every core) sharing X, see core_point_counts. Not used with graph, which has the counts already.
 	
 	Returns:
 		list: The output is a list of two lists, the first list contains the cluster label of each point, where -1 means that point is a noise point, the second list contains the indexes of the core points from the X array.
@@ -49,23 +367,38 @@ def dbscan(X, eps, minpts):
 	custer_label = 0
 	custer_labels = -1*np.ones(X.shape[0])
 	core_indexes = []
-	# core points
-	for i, x in enumerate(X):
-		if isCorePoint(x, X, eps, minpts):
-			core_indexes.append(i)
+	neighbour_index = build_index(X, eps, index)
+	neighbours = None
+	if graph:
+		# core points, from the neighbour counts
+		neighbours = neighbour_graph(X, eps, neighbour_index)
+		core_indexes = np.flatnonzero(np.diff(neighbours[0]) >= minpts).tolist()
+	elif n_jobs is not None:
+		counts = core_point_counts(X, eps, neighbour_index, n_jobs)
+		core_indexes = np.flatnonzero(counts >= minpts).tolist()
+	else:
+		# core points
+		for i, x in enumerate(X):
+			if isCorePoint(x, X, eps, minpts, neighbour_index):
+				core_indexes.append(i)
 
+	is_core = np.zeros(X.shape[0], dtype=bool)
+	is_core[core_indexes] = True
 	for core_index in core_indexes:
 		if custer_labels[core_index] == -1:
 			# this core point has no custer label
 			custer_label += 1
 			custer_labels[core_index] = custer_label
-			custer_labels = markNeighbours(core_index, X, eps, minpts, custer_labels, core_indexes, custer_label)
+			custer_labels = markNeighbours(core_index, X, eps, minpts, custer_labels, core_indexes, custer_label,
+			                               neighbour_index, neighbours, is_core)
 	return [custer_labels, core_indexes]
 
 
-def markNeighbours(core_index, X, eps, minpts, custer_labels, core_indexes, custer_label):
+def markNeighbours(core_index, X, eps, minpts, custer_labels, core_indexes, custer_label, neighbour_index=None,
+                   graph=None, is_core=None):
 	'''
-	recursive mark all neighbours of a core and neighbour of core neighbours
+	mark all neighbours of a core and neighbour of core neighbours, breadth first from a queue
+	so that clusters of any size use constant stack
 	:param core_index: index of core point in input X
 	:param X: input X
 	:param eps:
@@ -73,37 +406,55 @@ def markNeighbours(core_index, X, eps, minpts, custer_labels, core_indexes, cust
 	:param custer_labels: labels of custer
 	:param core_indexes: indexes of core points
 	:param custer_label: the current custer label
+	:param neighbour_index: index answering the region queries, see build_index
+	:param graph: the neighbour graph from neighbour_graph, read instead of querying
+	:param is_core: boolean mask of the core points, built from core_indexes if not given
 	:return:
 	'''
-	neighbours = getNeighbours(X[core_index], X, eps, minpts)
-	for neighbour in neighbours:
-		if custer_labels[neighbour] == -1:
-			custer_labels[neighbour] = custer_label
-			if neighbour in core_indexes:
-				markNeighbours(neighbour, X, eps, minpts, custer_labels, core_indexes, custer_label)
+	if is_core is None:
+		is_core = np.zeros(X.shape[0], dtype=bool)
+		is_core[core_indexes] = True
+	# every core point enters the queue once, when it gets its label
+	queue = collections.deque([core_index])
+	while queue:
+		point = queue.popleft()
+		if graph is not None:
+			indptr, indices = graph
+			neighbours = indices[indptr[point]:indptr[point + 1]]
+		else:
+			neighbours = np.ravel(getNeighbours(X[point], X, eps, minpts, neighbour_index))
+		unlabelled = neighbours[custer_labels[neighbours] == -1]
+		custer_labels[unlabelled] = custer_label
+		queue.extend(unlabelled[is_core[unlabelled]].tolist())
 	return custer_labels
 
 
-def getNeighbours(core, X, eps, minpts):
+def getNeighbours(core, X, eps, minpts, neighbour_index=None):
 	'''
 	:param core: axis of the core point
 	:param X: input X
 	:param eps: eps
 	:param minpts: min number of points
+	:param neighbour_index: index answering the query, by default every point is measured
 	:return:  indices of all neighbourhood if it is a core point
 	'''
+	if neighbour_index is not None:
+		return neighbour_index.query(core)
 	distances = np.linalg.norm(core - X, axis=1)
 	return np.argwhere(distances <= eps)
 
 
-def isCorePoint(x, X, eps, minpts):
+def isCorePoint(x, X, eps, minpts, neighbour_index=None):
 	'''
 	:param x: point
 	:param X: input X
 	:param eps: eps
 	:param minpts: min number of points
+	:param neighbour_index: index answering the query, by default every point is measured
 	:return: true if x is a core point
 	'''
+	if neighbour_index is not None:
+		return len(neighbour_index.query(x)) >= minpts
 	distances = np.linalg.norm(x - X, axis=1)
 	border_points = np.argwhere(distances <= eps)
 	if border_points.shape[0] >= minpts:
@@ -111,63 +462,389 @@ def isCorePoint(x, X, eps, minpts):
 	else:
 		return False
 
-def main():
-	
-	if len(sys.argv) != 4:
-		print("Wrong command format, please follwoing the command format below:")
-		print("python dbscan-template.py data_filepath eps minpts")
-		exit(0)
+def find_roots(parent, points):
+	'''
+	:param parent: union-find forest over point indexes, a root is its own parent
+	:return: the roots of points, whose parents are pointed straight at them
+	'''
+	roots = parent[points]
+	while True:
+		up = parent[roots]
+		if np.array_equal(up, roots):
+			break
+		roots = up
+	parent[points] = roots
+	return roots
 
-	X = read_data(sys.argv[1])
 
-	# Compute DBSCAN
-	db = dbscan(X, float(sys.argv[2]), int(sys.argv[3]))
+def union_roots(parent, a, b):
+	'''
+	Join the trees of every pair a[k], b[k]. The larger root is linked under the smaller one,
+	so the root of a tree stays its smallest point.
+	'''
+	while len(a):
+		root_a, root_b = find_roots(parent, a), find_roots(parent, b)
+		differ = root_a != root_b
+		a, b, root_a, root_b = a[differ], b[differ], root_a[differ], root_b[differ]
+		np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
 
-	# store output labels returned by your algorithm for automatic marking
-	with open('.'+os.sep+'Output'+os.sep+'labels.txt', "w") as f:
-		for e in db[0]:
-			f.write(str(e))
-			f.write('\n')
 
-	# store output core sample indexes returned by your algorithm for automatic marking
-	with open('.'+os.sep+'Output'+os.sep+'core_sample_indexes.txt', "w") as f:
-		for e in db[1]:
-			f.write(str(e))
-			f.write('\n')
+def label_clusters(parent, is_core, border_points, border_cores):
+	'''
+	:param parent: union-find forest joining the core points within eps of each other
+	:param is_core: core point mask
+	:param border_points, border_cores: pairs of a non-core point and a core point within eps of it
+	:return: [labels, core indexes] as dbscan returns them
+	'''
+	custer_labels = -1 * np.ones(len(is_core))
+	core_indexes = np.flatnonzero(is_core)
+	roots = find_roots(parent, core_indexes)
+	# clusters are numbered in the order of their first core point, as dbscan numbers them
+	first_cores = np.unique(roots)
+	custer_labels[core_indexes] = np.searchsorted(first_cores, roots) + 1
+	# a border point joins the first cluster that reaches it
+	border_roots = np.full(len(is_core), len(is_core))
+	np.minimum.at(border_roots, border_points, find_roots(parent, border_cores))
+	border = np.flatnonzero(border_roots < len(is_core))
+	custer_labels[border] = np.searchsorted(first_cores, border_roots[border]) + 1
+	return [custer_labels, core_indexes.tolist()]
+
+
+class IncrementalDBSCAN(object):
+	'''
+	DBSCAN over a point set that only grows. It keeps a grid of the points with cells
+	slightly wider than eps, the neighbour counts, the core flags, a union-find forest
+	over the core points and the (border point, core neighbour) pairs, so insert only
+	measures the neighbourhoods of the new points and of the points that became core.
+	result() gives what dbscan gives on all the points inserted so far, cluster numbers
+	included.
+	'''
+	def __init__(self, eps, minpts, block_size=2 ** 22):
+		'''
+		:param eps: eps
+		:param minpts: min number of points
+		:param block_size: the most distance components computed at once, as in neighbour_graph
+		'''
+		self.eps = eps
+		self.minpts = minpts
+		self.block_size = block_size
+		self.size = eps * (1 + 1e-6) if eps > 0 else 1.0
+		self.n = 0
+		self.dimension = None
+		self.X = None
+		self.cells = {}
+		self.counts = np.zeros(0, dtype=np.int64)
+		self.is_core = np.zeros(0, dtype=bool)
+		# every core point links to a smaller one, so a root is the first core point of its cluster
+		self.parent = np.zeros(0, dtype=np.intp)
+		# border pairs in one array per insert, merged and pruned by result
+		self.border_points = []
+		self.border_cores = []
+
+	def grow(self, n):
+		if self.X is not None and n <= len(self.X):
+			return
+		capacity = max(n, 2 * (0 if self.X is None else len(self.X)), 1024)
+		X = np.zeros((capacity, self.dimension))
+		counts = np.zeros(capacity, dtype=np.int64)
+		is_core = np.zeros(capacity, dtype=bool)
+		parent = np.arange(capacity)
+		if self.X is not None:
+			X[:self.n], counts[:self.n], is_core[:self.n], parent[:self.n] = \
+				self.X[:self.n], self.counts[:self.n], self.is_core[:self.n], self.parent[:self.n]
+		self.X, self.counts, self.is_core, self.parent = X, counts, is_core, parent
+
+	def cell_groups(self, points):
+		'''
+		:return: generator of (cell, points in it), for sorted point indexes
+		'''
+		if len(points) == 0:
+			return
+		cells = np.floor(self.X[points] / self.size).astype(np.int64)
+		order = np.lexsort(cells.T[::-1])
+		cells, points = cells[order], points[order]
+		bounds = np.flatnonzero(np.any(cells[1:] != cells[:-1], axis=1)) + 1
+		for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(points)]))):
+			yield tuple(cells[start].tolist()), points[start:end]
+
+	def neighbours(self, points):
+		'''
+		:param points: indexes of inserted points
+		:return: rows, columns: every pair of one of the points and a point within eps of it
+		'''
+		rows, columns = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+		offsets = np.array(list(itertools.product([-1, 0, 1], repeat=self.dimension)), dtype=np.int64)
+		for cell, cell_points in self.cell_groups(points):
+			candidates = [self.cells[tuple(neighbour)] for neighbour in (np.array(cell) + offsets).tolist()
+			              if tuple(neighbour) in self.cells]
+			candidates = np.sort(np.concatenate(candidates))
+			step = max(1, self.block_size // max(1, len(candidates) * self.dimension))
+			for start in range(0, len(cell_points), step):
+				sub_points = cell_points[start:start + step]
+				# the same norm as getNeighbours
+				distances = np.linalg.norm(self.X[sub_points][:, np.newaxis, :] - self.X[candidates][np.newaxis, :, :],
+				                           axis=2)
+				i, j = np.nonzero(distances <= self.eps)
+				rows.append(sub_points[i])
+				columns.append(candidates[j])
+		return np.concatenate(rows), np.concatenate(columns)
+
+	def insert(self, points):
+		'''
+		Add a batch of points, numbered after the points inserted before.
+		:param points: type: numpy array, shape: (n, d)
+		'''
+		points = np.atleast_2d(np.asarray(points, dtype=float))
+		if len(points) == 0:
+			return
+		if self.X is None:
+			self.dimension = points.shape[1]
+		start = self.n
+		self.grow(start + len(points))
+		self.X[start:start + len(points)] = points
+		self.n += len(points)
+		new = np.arange(start, self.n)
+		for cell, cell_points in self.cell_groups(new):
+			self.cells[cell] = np.concatenate((self.cells[cell], cell_points)) if cell in self.cells else cell_points
+
+		# new points count their whole neighbourhood, old points the new points in theirs
+		rows, columns = self.neighbours(new)
+		self.counts[new] = np.bincount(rows - start, minlength=len(new))
+		np.add.at(self.counts, columns[columns < start], 1)
+		# only the points counted above can have become core
+		touched = np.unique(columns)
+		became_core = touched[~self.is_core[touched] & (self.counts[touched] >= self.minpts)]
+		self.is_core[became_core] = True
+		old_rows, old_columns = self.neighbours(became_core[became_core < start])
+		rows, columns = np.concatenate((rows, old_rows)), np.concatenate((columns, old_columns))
+
+		# every pair that can have changed has a new point or a new core point in rows
+		row_core, column_core = self.is_core[rows], self.is_core[columns]
+		union_roots(self.parent, rows[row_core & column_core], columns[row_core & column_core])
+		border_points = np.concatenate((rows[~row_core & column_core], columns[row_core & ~column_core]))
+		border_cores = np.concatenate((columns[~row_core & column_core], rows[row_core & ~column_core]))
+		# keep one new pair per border point and cluster: clusters may still merge, and
+		# border points may still become core, so result settles both
+		roots = find_roots(self.parent, border_cores)
+		order = np.lexsort((roots, border_points))
+		border_points, border_cores, roots = border_points[order], border_cores[order], roots[order]
+		first = np.ones(len(border_points), dtype=bool)
+		first[1:] = (border_points[1:] != border_points[:-1]) | (roots[1:] != roots[:-1])
+		self.border_points.append(border_points[first])
+		self.border_cores.append(border_cores[first])
+
+	def result(self):
+		'''
+		:return: [labels, core indexes] as dbscan returns them for all the points inserted so far
+		'''
+		border_points = np.concatenate([np.empty(0, dtype=np.intp)] + self.border_points)
+		border_cores = np.concatenate([np.empty(0, dtype=np.intp)] + self.border_cores)
+		# drop the pairs of points that have become core since, once
+		keep = ~self.is_core[border_points]
+		self.border_points, self.border_cores = [border_points[keep]], [border_cores[keep]]
+		return label_clusters(self.parent, self.is_core[:self.n], border_points[keep], border_cores[keep])
+
+
+def dbscan_sweep(X, eps_values, minpts_values, index='auto', block_size=2 ** 22):
+	'''
+	Run dbscan for every combination of eps and minpts with a single distance computation.
+	Every pair of points within the largest eps is found once and sorted by distance, so the
+	pairs within a smaller eps are a prefix of them; each combination then only counts,
+	joins and labels those pairs.
+	:param X: input X
+	:param eps_values: type: sequence of eps
+	:param minpts_values: type: sequence of minpts
+	:param index: the neighbour index used for the largest eps, see build_index
+	:param block_size: the most distance components computed at once, see neighbour_pairs
+	:return: dictionary of (eps, minpts) to [labels, core indexes], equal to what dbscan returns.
+	The pairs within the largest eps are all held in memory, as with graph in dbscan.
+	'''
+	n = X.shape[0]
+	rows, columns, distances = neighbour_pairs(X, max(eps_values), build_index(X, max(eps_values), index), block_size)
+	order = np.argsort(distances, kind='stable')
+	rows, columns, distances = rows[order], columns[order], distances[order]
+	results = {}
+	for eps in sorted(set(eps_values)):
+		end = np.searchsorted(distances, eps, side='right')
+		eps_rows, eps_columns = rows[:end], columns[:end]
+		counts = np.bincount(eps_rows, minlength=n)
+		for minpts in sorted(set(minpts_values)):
+			is_core = counts >= minpts
+			row_core, column_core = is_core[eps_rows], is_core[eps_columns]
+			parent = np.arange(n)
+			# every pair is there in both orders, one is enough to join
+			joined = row_core & column_core & (eps_rows < eps_columns)
+			union_roots(parent, eps_rows[joined], eps_columns[joined])
+			border = ~row_core & column_core
+			results[(eps, minpts)] = label_clusters(parent, is_core, eps_rows[border], eps_columns[border])
+	return results
+
+
+def save_sweep(file_name, results):
+	'''
+	Write the results of dbscan_sweep to one compressed .npz file, the labels as integers
+	and the core points as a bit mask, one row per combination.
+	'''
+	keys = sorted(results)
+	n = len(results[keys[0]][0]) if keys else 0
+	labels = np.zeros((len(keys), n), dtype=np.int32)
+	is_core = np.zeros((len(keys), n), dtype=bool)
+	for k, key in enumerate(keys):
+		labels[k] = results[key][0]
+		is_core[k, results[key][1]] = True
+	np.savez_compressed(file_name, eps=np.array([key[0] for key in keys], dtype=float),
+	                    minpts=np.array([key[1] for key in keys], dtype=np.int64), labels=labels,
+	                    core=np.packbits(is_core, axis=1), n=n)
+
+
+def load_sweep(file_name):
+	'''
+	:return: the results written by save_sweep, as dbscan_sweep returns them
+	'''
+	with np.load(file_name) as data:
+		is_core = np.unpackbits(data['core'], axis=1, count=int(data['n'])).astype(bool)
+		return {(float(eps), int(minpts)): [labels.astype(float), np.flatnonzero(core).tolist()]
+		        for eps, minpts, labels, core in zip(data['eps'], data['minpts'], data['labels'], is_core)}
 
-	_,dimension = X.shape
 
-	# plot the graph is the data is dimensiont 2
-	if dimension == 2:
-		core_samples_mask = np.zeros_like(np.array(db[0]), dtype=bool)
-		core_samples_mask[db[1]] = True
-		labels = np.array(db[0])
+def plot_clusters(X, labels, core_indexes, filepath, max_points=MAX_PLOT_POINTS):
+	'''Plot 2-D points coloured by cluster, core points larger, noise black, and save the figure
+	Args:
+		X (numpy.ndarray): points with dimension (n, 2)
+		labels (numpy.ndarray): cluster label of each point, as returned by dbscan
+		core_indexes (list): indexes of the core points, as returned by dbscan
+		filepath (str): the path to the image to be written
+		max_points (int): at most this many points, picked at random, are drawn, as more only hide each other and slow the plot down. The title still counts the clusters of all points.
+	'''
+	# matplotlib takes longer to import than small inputs take to cluster, so only plots pay for it
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+
+	core_samples_mask = np.zeros_like(np.array(labels), dtype=bool)
+	core_samples_mask[core_indexes] = True
+	labels = np.array(labels)
 
-		# Number of clusters in labels, ignoring noise if present.
-		n_clusters_ = len(set(labels)) - (1 if -1 in labels else 0)
+	# Number of clusters in labels, ignoring noise if present.
+	unique_labels = np.unique(labels)
+	n_clusters_ = len(unique_labels) - (1 if -1 in unique_labels else 0)
 
-		# Black removed and is used for noise instead.
-		unique_labels = set(labels)
-		colors = [plt.cm.Spectral(each)
-		          for each in np.linspace(0, 1, len(unique_labels))]
+	if len(X) > max_points:
+		sample = np.sort(np.random.RandomState(0).choice(len(X), max_points, replace=False))
+		X, labels, core_samples_mask = X[sample], labels[sample], core_samples_mask[sample]
 
+	# Black removed and is used for noise instead.
+	colors = [plt.cm.Spectral(each)
+	          for each in np.linspace(0, 1, len(unique_labels))]
 
-		for k, col in zip(unique_labels, colors):
-		    if k == -1:
-		        # Black used for noise.
-		        col = [0, 0, 0, 1]
+	for k, col in zip(unique_labels, colors):
+		if k == -1:
+			# Black used for noise.
+			col = [0, 0, 0, 1]
 
-		    class_member_mask = (labels == k)
+		class_member_mask = (labels == k)
 
-		    xy = X[class_member_mask & core_samples_mask]
-		    plt.plot(xy[:, 0], xy[:, 1], 'o', markerfacecolor=tuple(col),
-		             markeredgecolor='k', markersize=14)
+		xy = X[class_member_mask & core_samples_mask]
+		plt.plot(xy[:, 0], xy[:, 1], 'o', markerfacecolor=tuple(col),
+		         markeredgecolor='k', markersize=14)
 
-		    xy = X[class_member_mask & ~core_samples_mask]
-		    plt.plot(xy[:, 0], xy[:, 1], 'o', markerfacecolor=tuple(col),
-		             markeredgecolor='k', markersize=6)
+		xy = X[class_member_mask & ~core_samples_mask]
+		plt.plot(xy[:, 0], xy[:, 1], 'o', markerfacecolor=tuple(col),
+		         markeredgecolor='k', markersize=6)
 
-		plt.title('Estimated number of clusters: %d' % n_clusters_)
-		plt.savefig('.'+os.sep+'Output'+os.sep+'cluster-result.png')
+	plt.title('Estimated number of clusters: %d' % n_clusters_)
+	plt.savefig(filepath)
+	plt.close()
 
-main()
\ No newline at end of file
+
+def measure_startup(repeat=5):
+	'''Time launching this script up to main, without clustering anything
+	Args:
+		repeat (int): number of launches, the fastest one is kept
+
+	Returns:
+		float: seconds of the fastest launch
+	'''
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, os.path.abspath(__file__)], stdout=subprocess.DEVNULL, check=True)
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+
+def main():
+	
+	options = [arg for arg in sys.argv[1:] if arg in ('--no-plot', '--graph') or
+	           arg.startswith(('--plot-points=', '--n-jobs=', '--index='))]
+	args = [arg for arg in sys.argv[1:] if arg not in options]
+	plot = '--no-plot' not in options
+	graph = '--graph' in options
+	max_plot_points = MAX_PLOT_POINTS
+	n_jobs = None
+	index = 'auto'
+	for arg in options:
+		if arg.startswith('--plot-points='):
+			max_plot_points = int(arg[len('--plot-points='):])
+		elif arg.startswith('--n-jobs='):
+			n_jobs = int(arg[len('--n-jobs='):])
+		elif arg.startswith('--index='):
+			index = arg[len('--index='):]
+
+	if args == ['--startup-time']:
+		seconds = measure_startup()
+		print("startup %.3fs, budget %.3fs" % (seconds, STARTUP_BUDGET))
+		exit(1 if seconds > STARTUP_BUDGET else 0)
+
+	if len(args) == 3 and args[0] == '--convert':
+		convert_data(args[1], args[2])
+		return
+
+	if len(args) != 3:
+		print("Wrong command format, please follwoing the command format below:")
+		print("python dbscan-template.py data_filepath eps minpts [--no-plot] [--plot-points=N] [--index=NAME] "
+		      "[--graph] [--n-jobs=N]")
+		print("eps and minpts may be comma separated lists, to cluster with every combination of them")
+		print("--index=NAME answers region queries with a grid, kdtree or brute index (default auto)")
+		print("--graph computes every neighbourhood once into a neighbour graph, which needs memory for all pairs")
+		print("--n-jobs=N counts core point neighbours over N processes, -1 for every core")
+		print("--no-plot skips the plot of 2-D data, --plot-points=N draws at most N points of it (default %d)" %
+		      MAX_PLOT_POINTS)
+		print("python dbscan-template.py --convert data_filepath npy_filepath")
+		print("converts a data file to .npy, which loads without parsing")
+		print("python dbscan-template.py --startup-time")
+		print("times launching the script against its budget of %gs" % STARTUP_BUDGET)
+		exit(0)
+
+	X = read_data(args[0])
+
+	if ',' in args[1] or ',' in args[2]:
+		# parameter sweep, every combination from one neighbourhood computation
+		results = dbscan_sweep(X, [float(eps) for eps in args[1].split(',')],
+		                       [int(minpts) for minpts in args[2].split(',')], index)
+		save_sweep('.'+os.sep+'Output'+os.sep+'sweep.npz', results)
+		for (eps, minpts), (labels, core_indexes) in sorted(results.items()):
+			print("eps %g minpts %d: %d clusters, %d core points, %d noise points" %
+			      (eps, minpts, labels.max(initial=0), len(core_indexes), np.count_nonzero(labels == -1)))
+		return
+
+	# Compute DBSCAN
+	db = dbscan(X, float(args[1]), int(args[2]), index, graph, n_jobs)
+
+	# store output labels returned by your algorithm for automatic marking
+	write_lines('.'+os.sep+'Output'+os.sep+'labels.txt', db[0])
+
+	# store output core sample indexes returned by your algorithm for automatic marking
+	write_lines('.'+os.sep+'Output'+os.sep+'core_sample_indexes.txt', db[1])
+
+	_,dimension = X.shape
+
+	# plot the graph is the data is dimensiont 2
+	if plot and dimension == 2:
+		try:
+			plot_clusters(X, db[0], db[1], '.'+os.sep+'Output'+os.sep+'cluster-result.png', max_plot_points)
+		except ImportError:
+			print("matplotlib is not installed, the plot is skipped")
+
+if __name__ == '__main__':
+	main()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import numpy as np
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import subprocess
+import tracemalloc
+from DecisionTreeRegressor import MyDecisionTreeRegressor
+from GradientBoostingRegressor import MyGradientBoostingRegressor
+
+GRID = {'n_samples': [1000, 10000], 'n_features': [10, 50], 'max_depth': [3, 6], 'n_estimators': [10, 50]}
+QUICK_GRID = {'n_samples': [500], 'n_features': [5], 'max_depth': [3], 'n_estimators': [5]}
+
+
+def make_data(n_samples, n_features, seed=0):
+    '''
+    :return: synthetic regression data, a noisy nonlinear function of the first features
+    '''
+    rng = np.random.RandomState(seed)
+    X = rng.rand(n_samples, n_features)
+    y = np.sin(4 * X[:, 0]) + X[:, 1 % n_features] * X[:, 2 % n_features] + 0.1 * rng.randn(n_samples)
+    return X, y
+
+
+def measure(function, repeat):
+    '''
+    :return: the best wall time of repeat calls in seconds, and the peak
+    memory in bytes traced during one more call
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    # tracing slows allocation down, so it gets its own call
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def split_data_root(X, y):
+    '''
+    :return: a function timing one root split search of a tree
+    '''
+    tree = MyDecisionTreeRegressor()
+
+    def search():
+        tree.X = X
+        tree.prepare(y, None, None, X.shape[1])
+        try:
+            tree.split_data(0, len(tree.index))
+        finally:
+            tree.finish()
+    return search
+
+
+def run_tree_case(n_samples, n_features, max_depth, repeat, binning=None):
+    X, y = make_data(n_samples, n_features)
+    tree = MyDecisionTreeRegressor(max_depth=max_depth, min_samples_split=2, binning=binning)
+    timings = {}
+    for name, function in [('tree_fit', lambda: tree.fit(X, y)),
+                           ('tree_split_data', split_data_root(X, y)),
+                           ('tree_predict', lambda: tree.predict(X))]:
+        if binning and name == 'tree_split_data':
+            continue
+        seconds, peak = measure(function, repeat)
+        timings[name] = {'seconds': seconds, 'peak_bytes': peak}
+    return timings
+
+
+def run_gbr_case(n_samples, n_features, max_depth, n_estimators, repeat, binning=None):
+    X, y = make_data(n_samples, n_features)
+    gbr = MyGradientBoostingRegressor(n_estimators=n_estimators, max_depth=max_depth, min_samples_split=2,
+                                      binning=binning)
+    timings = {}
+    for name, function in [('gbr_fit', lambda: gbr.fit(X, y)),
+                           ('gbr_predict', lambda: gbr.predict(X))]:
+        seconds, peak = measure(function, repeat)
+        timings[name] = {'seconds': seconds, 'peak_bytes': peak}
+    return timings
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, baseline, threshold):
+    '''
+    Print the cases that got slower than baseline by more than threshold.
+    Both runs must have used the same binning and repeat, or their timings
+    do not measure the same thing.
+    :return: number of regressions
+    '''
+    for key in ['binning', 'repeat']:
+        if results.get(key) != baseline.get(key):
+            raise ValueError("cannot compare runs with %s %r and %r" % (key, results.get(key), baseline.get(key)))
+    old = {json.dumps(case['params'], sort_keys=True): case['timings'] for case in baseline['cases']}
+    regressions = 0
+    for case in results['cases']:
+        timings = old.get(json.dumps(case['params'], sort_keys=True))
+        if timings is None:
+            continue
+        for name, timing in case['timings'].items():
+            if name in timings and timing['seconds'] > timings[name]['seconds'] * (1 + threshold):
+                regressions += 1
+                print("slower: %s %s %.4gs -> %.4gs" % (name, case['params'], timings[name]['seconds'],
+                                                        timing['seconds']))
+    return regressions
+
+
+# Run the benchmarks
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Time fit, split_data and predict on synthetic data.")
+    parser.add_argument('--output', default='benchmark.json', help="JSON file the results are written to")
+    parser.add_argument('--repeat', type=int, default=3, help="timed calls per case, the best one is kept")
+    parser.add_argument('--quick', action='store_true', help="a single small case, as a smoke test")
+    parser.add_argument('--binning', type=int, default=None, help="benchmark histogram trees with this many bins")
+    parser.add_argument('--compare', default=None, help="earlier results to report regressions against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown reported by --compare")
+    args = parser.parse_args()
+
+    grid = QUICK_GRID if args.quick else GRID
+    results = {'environment': environment(), 'repeat': args.repeat, 'binning': args.binning, 'cases': []}
+    # the tree timings do not depend on n_estimators, so they are measured once
+    tree_timings = {}
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid.keys(), values))
+        tree_params = (params['n_samples'], params['n_features'], params['max_depth'])
+        if tree_params not in tree_timings:
+            tree_timings[tree_params] = run_tree_case(*tree_params, repeat=args.repeat, binning=args.binning)
+        timings = dict(tree_timings[tree_params])
+        timings.update(run_gbr_case(repeat=args.repeat, binning=args.binning, **params))
+        results['cases'].append({'params': params, 'timings': timings})
+        print(params, ", ".join("%s %.4gs %.3gMB" % (name, timing['seconds'], timing['peak_bytes'] / 2.0 ** 20)
+                                for name, timing in timings.items()))
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+        try:
+            regressions = compare(results, baseline, args.threshold)
+        except ValueError as error:
+            parser.error(str(error))
+        sys.exit(1 if regressions else 0)
@@ -2,9 +2,327 @@ import numpy as np
 import os
 import json
 import operator
+import tempfile
+import threading
+import itertools
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+# binary model format: a 64 byte header followed by little-endian arrays,
+# each starting on an 8 byte boundary so it can be memory-mapped in place
+MODEL_MAGIC = b'MYTREEBN'
+MODEL_VERSION = 2
+MODEL_TREE, MODEL_ENSEMBLE = 0, 1
+MODEL_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('kind', '<u4'), ('n_trees', '<i8'),
+                         ('n_nodes', '<i8'), ('depth', '<i8'), ('learning_rate', '<f8'), ('f0', '<f8'),
+                         ('reserved', '<i8')])
+# feature, threshold, left, right, value, missing_left; version 1 files lack
+# missing_left and send every missing value right
+NODE_COLUMNS = {1: ['<i4', '<f8', '<i4', '<i4', '<f8'],
+                2: ['<i4', '<f8', '<i4', '<i4', '<f8', '<u1']}
+
+
+def is_sparse(X):
+    return sparse is not None and sparse.issparse(X)
+
+
+def quantize(X, max_bins=255):
+    '''
+    Bin every feature into at most max_bins quantile bins.
+    :param X: Feature data, type: numpy array or scipy.sparse matrix, shape: (N, num_feature)
+    :param max_bins: type: integer, at most 255 so codes, including the
+    missing value code, fit in uint8
+    :return: codes: bin code of every value, type: numpy array of uint8, shape: (N, num_feature);
+    missing values (NaN) get the code max(len(e) for e in edges) of every feature
+    edges: list of per-feature arrays, bin k holds the values x <= edges[k];
+    every edge is a value of X so it can be used as a splitting threshold
+    '''
+    if not 1 < max_bins <= 255:
+        raise ValueError("max_bins must be between 2 and 255, got %r" % max_bins)
+    if is_sparse(X):
+        # one dense column at a time, the float matrix is never densified
+        X = X.tocsc()
+    codes = np.empty(X.shape, dtype=np.uint8)
+    missing = []
+    edges = []
+    for j in range(X.shape[1]):
+        x = X[:, j].toarray().ravel() if is_sparse(X) else X[:, j]
+        values = quantile_edges(*np.unique(x[~np.isnan(x)], return_counts=True), max_bins=max_bins)
+        codes[:, j] = np.searchsorted(values, x, side='left')
+        missing.append(np.flatnonzero(np.isnan(x)))
+        edges.append(values)
+    missing_code = max(len(values) for values in edges)
+    for j, rows in enumerate(missing):
+        codes[rows, j] = missing_code
+    return codes, edges
+
+
+def quantile_edges(values, counts, max_bins=255):
+    '''
+    :param values: distinct values of a feature, sorted, type: numpy array
+    :param counts: number of rows holding each value, type: numpy array
+    :return: the bin edges quantize uses: every value if there are at most
+    max_bins of them, otherwise the values at max_bins evenly spaced ranks
+    '''
+    if len(values) <= max_bins:
+        return values
+    ranks = np.cumsum(counts)
+    positions = (np.arange(1, max_bins + 1) * ranks[-1]) // max_bins - 1
+    return np.unique(values[np.searchsorted(ranks, positions, side='right')])
+
+
+def decode(codes, edges):
+    '''
+    :return: a representative value of every code, the upper edge of its
+    bin or NaN for missing values, type: numpy array, shape: codes.shape.
+    Thresholds are edges, and x <= edges[j][k] exactly when the code of x
+    is at most k, so a tree routes these values the way it routes X.
+    '''
+    X = np.empty(codes.shape)
+    for j, values in enumerate(edges):
+        values = np.append(values, np.nan)
+        X[:, j] = values[np.minimum(codes[:, j], len(values) - 1)]
+    return X
+
+
+def read_chunks(file_name, chunk_rows=65536, delimiter=','):
+    '''
+    Read a data file a block of rows at a time.
+    :param file_name: a .npy file, which is memory-mapped, or a delimited
+    text file such as the csv files in Test_data, whose empty cells are missing values
+    :return: generator of float arrays of at most chunk_rows rows
+    '''
+    if file_name.endswith('.npy'):
+        data = np.load(file_name, mmap_mode='r')
+        for start in range(0, len(data), chunk_rows):
+            yield np.asarray(data[start:start + chunk_rows], dtype=float)
+        return
+    with open(file_name, 'r') as fp:
+        n_columns = None
+        while True:
+            lines = list(itertools.islice(fp, chunk_rows))
+            if not lines:
+                return
+            if n_columns is None:
+                n_columns = len(lines[0].split(delimiter))
+            # empty cells read as NaN, as np.genfromtxt reads them for fit;
+            # it squeezes single rows and columns, so the shape is restored here
+            yield np.genfromtxt(lines, delimiter=delimiter).reshape(-1, n_columns)
+
+
+def read_labels(file_name, chunk_rows=65536, delimiter=','):
+    '''
+    :return: the single column of a label file, type: numpy array, shape: (N,)
+    '''
+    return np.concatenate([chunk.ravel() for chunk in read_chunks(file_name, chunk_rows, delimiter)])
+
+
+def quantize_file(file_name, max_bins=255, chunk_rows=65536, delimiter=',', codes_file=None, max_summary=2 ** 14):
+    '''
+    Streaming quantize: the same codes and edges from a feature file read
+    in blocks, without holding its float matrix in memory. The first pass
+    keeps the distinct values and counts of every feature, merging
+    neighbouring values whenever a feature has more than max_summary of
+    them, so the edges are exact until then and approximate quantiles
+    after. The second pass encodes the rows.
+    :param file_name: see read_chunks
+    :param codes_file: optional .npy file the codes are written to and
+    memory-mapped from, so they do not have to fit in memory either
+    :return: codes, edges, see quantize
+    '''
+    if not 1 < max_bins <= 255:
+        raise ValueError("max_bins must be between 2 and 255, got %r" % max_bins)
+    summaries = None
+    n_rows = 0
+    for chunk in read_chunks(file_name, chunk_rows, delimiter):
+        if summaries is None:
+            summaries = [(np.empty(0), np.empty(0, dtype=np.int64)) for _ in range(chunk.shape[1])]
+        n_rows += len(chunk)
+        for j, (values, counts) in enumerate(summaries):
+            x = chunk[:, j]
+            chunk_values, chunk_counts = np.unique(x[~np.isnan(x)], return_counts=True)
+            values, inverse = np.unique(np.concatenate((values, chunk_values)), return_inverse=True)
+            counts = np.bincount(inverse, np.concatenate((counts, chunk_counts)), len(values)).astype(np.int64)
+            if len(values) > max_summary:
+                # keep the values at evenly spaced ranks, each absorbing the
+                # counts of the values merged into it
+                ranks = np.cumsum(counts)
+                keep = np.unique(np.searchsorted(ranks, (np.arange(1, max_summary + 1) * ranks[-1]) // max_summary - 1,
+                                                 side='right'))
+                values, counts = values[keep], np.diff(np.concatenate(([0], ranks[keep])))
+            summaries[j] = (values, counts)
+    if summaries is None:
+        raise ValueError("%s holds no rows" % file_name)
+    edges = [quantile_edges(values, counts, max_bins) for values, counts in summaries]
+    missing_code = max(len(values) for values in edges)
+    shape = (n_rows, len(edges))
+    if codes_file is None:
+        codes = np.empty(shape, dtype=np.uint8)
+    else:
+        codes = np.lib.format.open_memmap(codes_file, mode='w+', dtype=np.uint8, shape=shape)
+    start = 0
+    for chunk in read_chunks(file_name, chunk_rows, delimiter):
+        for j, values in enumerate(edges):
+            x = chunk[:, j]
+            codes[start:start + len(chunk), j] = np.where(np.isnan(x), missing_code,
+                                                          np.searchsorted(values, x, side='left'))
+        start += len(chunk)
+    return codes, edges
+
+
+def write_model(file_name, kind, roots, columns, compiled=None, depth=0, learning_rate=1.0, f0=0.0):
+    '''
+    Write node tables in the binary model format.
+    :param kind: MODEL_TREE or MODEL_ENSEMBLE
+    :param roots: index of the first node of every tree
+    :param columns: feature, threshold, left, right, value and missing_left of
+    all trees concatenated, with child ids local to each tree
+    :param compiled: the same columns of a compiled ensemble, or None
+    '''
+    if len(columns[0]) >= 2 ** 31:
+        raise ValueError("too many nodes for the binary model format")
+    header = np.zeros((), dtype=MODEL_HEADER)
+    header['magic'], header['version'], header['kind'] = MODEL_MAGIC, MODEL_VERSION, kind
+    header['n_trees'], header['n_nodes'], header['depth'] = len(roots), len(columns[0]), depth
+    header['learning_rate'], header['f0'] = learning_rate, f0
+    with open(file_name, 'wb') as fp:
+        fp.write(header.tobytes())
+        fp.write(np.asarray(roots, dtype='<i8').tobytes())
+        for column, dtype in zip(list(columns) + list(compiled or []), NODE_COLUMNS[MODEL_VERSION] * 2):
+            data = np.asarray(column, dtype=dtype).tobytes()
+            fp.write(data + b'\0' * (-len(data) % 8))
+
+
+def read_model(file_name):
+    '''
+    Memory-map a file written by write_model. The arrays are read-only views
+    of the mapping, so processes loading the same file share its pages.
+    :return: header, roots, node table columns, compiled columns or None
+    '''
+    buffer = np.memmap(file_name, dtype=np.uint8, mode='r')
+    header = buffer[:MODEL_HEADER.itemsize].view(MODEL_HEADER)[0]
+    if header['magic'] != MODEL_MAGIC:
+        raise ValueError("%s is not a binary model file" % file_name)
+    if header['version'] not in NODE_COLUMNS:
+        raise ValueError("unsupported model format version %d" % header['version'])
+    n_trees, n_nodes = int(header['n_trees']), int(header['n_nodes'])
+    offset = MODEL_HEADER.itemsize
+    roots = buffer[offset:offset + 8 * n_trees].view('<i8')
+    offset += 8 * n_trees
+    tables = []
+    for _ in range(2 if header['kind'] == MODEL_ENSEMBLE else 1):
+        table = []
+        for dtype in NODE_COLUMNS[int(header['version'])]:
+            size = np.dtype(dtype).itemsize * n_nodes
+            table.append(buffer[offset:offset + size].view(dtype))
+            offset += size + (-size % 8)
+        if len(table) == 5:
+            table.append(np.zeros(n_nodes, dtype=bool))
+        else:
+            table[5] = table[5].view(bool)
+        tables.append(table)
+    return header, roots, tables[0], tables[1] if len(tables) > 1 else None
+
+
+class Telemetry(object):
+    def __init__(self, file_name=None, trace_memory=False, callback=None):
+        '''
+        Training statistics, collected when passed as telemetry to either
+        regressor. With telemetry=None, the default, nothing is measured.
+        Counters such as candidates (split thresholds scored), split_seconds,
+        partition_seconds and histogram_seconds are summed by the trees, and
+        every finished span, a tree fit or a boosting stage, becomes a record
+        holding the counters added during it.
+        :param file_name: type: string or None, a JSON lines file every record is appended to
+        :param trace_memory: type: boolean, also record allocated_bytes, the peak
+        memory traced by tracemalloc during the span above its start; tracing
+        slows allocation down
+        :param callback: type: function or None, called with every record as it is made
+
+        records: type: list of dictionaries, every record so far
+        totals: type: dictionary, the counters summed over all spans
+        '''
+        self.file_name = file_name
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.records = []
+        self.totals = {}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, **counts):
+        # trees built on the worker pool add concurrently
+        with self.lock:
+            for key, value in counts.items():
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    def begin(self):
+        '''
+        :return: a new span, to be passed to end
+        '''
+        span = {'start': time.perf_counter(), 'totals': dict(self.totals)}
+        if self.trace_memory:
+            # tracing slows every allocation, so the span that starts it stops it
+            span['started_tracing'] = not tracemalloc.is_tracing()
+            if span['started_tracing']:
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            # the enclosing spans keep the peak this one is about to reset
+            for outer in self.spans:
+                outer['peak'] = max(outer['peak'], peak)
+            tracemalloc.reset_peak()
+            span['base'] = span['peak'] = current
+        self.spans.append(span)
+        return span
+
+    def end(self, span, event, **fields):
+        '''
+        Close a span and record it.
+        :param event: type: string, what the span measured, such as 'tree' or 'stage'
+        :param fields: further values of the record
+        :return: the record
+        '''
+        self.spans.remove(span)
+        record = {'event': event, 'seconds': time.perf_counter() - span['start']}
+        with self.lock:
+            for key, value in self.totals.items():
+                record[key] = value - span['totals'].get(key, 0)
+        if self.trace_memory:
+            peak = max(span['peak'], tracemalloc.get_traced_memory()[1])
+            for outer in self.spans:
+                outer['peak'] = max(outer['peak'], peak)
+            record['allocated_bytes'] = peak - span['base']
+            if span['started_tracing']:
+                tracemalloc.stop()
+        record.update(fields)
+        record = {key: value.item() if isinstance(value, np.generic) else value for key, value in record.items()}
+        self.records.append(record)
+        if self.file_name is not None:
+            with open(self.file_name, 'a') as fp:
+                fp.write(json.dumps(record) + '\n')
+        if self.callback is not None:
+            self.callback(record)
+        return record
+
+    def export(self, file_name):
+        '''
+        Write every record so far to a JSON lines file.
+        '''
+        with open(file_name, 'w') as fp:
+            for record in self.records:
+                fp.write(json.dumps(record) + '\n')
+
 
 class MyDecisionTreeRegressor():
-    def __init__(self, max_depth=5, min_samples_split=1):
+    def __init__(self, max_depth=5, min_samples_split=1, binning=None, n_jobs=None, parallel_subtrees=False,
+                 telemetry=None):
         '''
         Initialization
         :param max_depth: type: integer
@@ -14,104 +332,666 @@ class MyDecisionTreeRegressor():
         of the input variables.
         :param min_samples_split: type: integer
         minimum number of samples required to split an internal node:
+        :param binning: type: integer or None
+        when set, each feature is quantized into at most this many bins
+        (up to 255) and splits are searched on per-node histograms instead
+        of on every distinct value. None trains the exact tree.
+        :param n_jobs: type: integer or None
+        number of worker threads that search features for the best split in
+        parallel; -1 uses every core. They share X without copying and the
+        chosen split is the same as with None, which searches serially.
+        :param parallel_subtrees: type: boolean
+        with n_jobs, also build independent subtrees of at least
+        min_subtree_rows rows on the worker pool. The fitted tree is the
+        same as the serial build's.
+        :param telemetry: type: Telemetry or None
+        when set, every fit adds its split search, partition and histogram
+        counters to it and records a 'tree' event with the nodes and leaves
+        built and the rows fitted.
 
-        root: type: dictionary, the root node of the regression tree.
+        feature, threshold, left, right, value, missing_left: type: numpy arrays,
+        the fitted tree as a flat node table. Internal nodes route
+        x[feature] <= threshold to the node index in left and otherwise to
+        right; a missing (NaN) x[feature] goes left where missing_left is set,
+        the direction that scored better during fit. Leaves have feature -1
+        and hold their prediction in value.
+        X may be a scipy.sparse matrix: the exact split search then scans only
+        the stored entries of each column and treats the rest as one block
+        of zeros.
+        root: type: dictionary, the root node of the regression tree, rebuilt
+        from the node table on demand.
+        train_leaves: type: numpy array, shape: (N,), the leaf node each training
+        row ended in during fit, so callers can score the training set without
+        traversing the tree again; -1 for rows left out of the fit.
+        max_exact_ties: type: integer, the largest number of near-tied split
+        candidates that are re-scored exactly in row order; above it the
+        split can differ from the serial search, see split_data.
+        min_parallel_rows: type: integer, nodes with fewer rows are searched
+        serially since dispatching them costs more than it saves.
+        min_subtree_rows: type: integer, the same cutoff for whole subtrees.
         '''
 
         self.max_depth = max_depth
         self.min_samples_split = min_samples_split
-        self.root = None
-        
-    def get_groups(self, j, s, data):
-        left_data = []
-        right_data = []
-        for each_data in data:
-            if each_data[j] <= s:
-                left_data.append(each_data)
-            else:
-                right_data.append(each_data)
-        return np.array(left_data), np.array(right_data)    
-    
-    def split_data(self, data):
-        min_error = np.finfo(float).max
+        self.binning = binning
+        self.n_jobs = n_jobs
+        self.parallel_subtrees = parallel_subtrees
+        self.telemetry = telemetry
+        self.span = None
+        self.pool = None
+        self.feature = None
+        self.threshold = None
+        self.left = None
+        self.right = None
+        self.value = None
+        self.missing_left = None
+        self.sparse = False
+        self.train_leaves = None
+        self.max_exact_ties = 32
+        self.min_parallel_rows = 2048
+        self.min_subtree_rows = 2048
+
+    def partition(self, start, end, left_mask):
+        '''
+        Stable in-place partition of the node slice self.index[start:end], so
+        both children keep their rows in original order.
+        :param left_mask: type: boolean numpy array, shape: (end - start,)
+        :return: the (start, end) slices of the left and right child
+        '''
+        if self.telemetry is not None:
+            partition_start = time.perf_counter()
+        rows = self.index[start:end]
+        mid = start + np.count_nonzero(left_mask)
+        rows[:] = np.concatenate((rows[left_mask], rows[~left_mask]))
+        if self.telemetry is not None:
+            self.telemetry.add(partition_seconds=time.perf_counter() - partition_start)
+        return [(start, mid), (mid, end)]
+
+    def feature_values(self, rows, j):
+        '''
+        :param rows: node rows, type: sorted numpy array
+        :return: values of feature j for the rows, and None; for sparse X only
+        the stored values, and their positions among the rows
+        '''
+        if not self.sparse:
+            return self.X[rows, j], None
+        start, end = self.X.indptr[j], self.X.indptr[j + 1]
+        column_rows, column_values = self.X.indices[start:end], self.X.data[start:end]
+        if start == end or len(rows) == 0:
+            return column_values[:0], np.empty(0, dtype=np.intp)
+        # both row lists are sorted; search the longer one for the shorter one
+        if len(rows) < len(column_rows):
+            at = np.minimum(np.searchsorted(column_rows, rows), len(column_rows) - 1)
+            hit = column_rows[at] == rows
+            return column_values[at[hit]], np.flatnonzero(hit)
+        at = np.minimum(np.searchsorted(rows, column_rows), len(rows) - 1)
+        hit = rows[at] == column_rows
+        return column_values[hit], at[hit]
+
+    def dense_values(self, rows, j):
+        x, positions = self.feature_values(rows, j)
+        if positions is None:
+            return x
+        dense = np.zeros(len(rows))
+        dense[positions] = x
+        return dense
+
+    def scan_feature(self, x, y, positions=None):
+        '''
+        Score every distinct value of one feature as a splitting threshold in a
+        single vectorized pass. The feature is sorted once and the SSE of both
+        sides is derived from prefix sums of y and y^2. Rows with a missing
+        value are tried on both sides of every threshold.
+        :param x: feature column, type: numpy array, shape: (N,)
+        :param y: centered label data, type: numpy array, shape: (N,)
+        :param positions: for a sparse column, the rows that x holds values
+        for; all other rows are zeros and are scored as a single entry
+        :return: errors, thresholds, the first row each threshold occurs in
+        and whether missing values go left, for every candidate that leaves
+        both groups non-empty
+        '''
+        n = len(y)
+        if positions is None:
+            positions = np.arange(n)
+        missing = np.isnan(x)
+        n_missing = np.count_nonzero(missing)
+        if n_missing:
+            missing_rows = positions[missing]
+            missing_y = y[missing_rows]
+            missing_sum, missing_sum2 = np.sum(missing_y), np.dot(missing_y, missing_y)
+            x, positions = x[~missing], positions[~missing]
+        order = np.argsort(x, kind='mergesort')
+        x_sorted, rows_sorted = x[order], positions[order]
+        y_sorted = y[rows_sorted]
+        y2_sorted = y_sorted * y_sorted
+        n_entries = np.ones(len(x_sorted))
+        n_zeros = n - n_missing - len(x_sorted)
+        if n_zeros:
+            # the unstored zeros of a sparse column form one weighted entry
+            is_zero = np.ones(n, dtype=bool)
+            is_zero[positions] = False
+            if n_missing:
+                is_zero[missing_rows] = False
+            zero_rows = np.flatnonzero(is_zero)
+            zero_y = y[zero_rows]
+            at = np.searchsorted(x_sorted, 0.0)
+            x_sorted = np.insert(x_sorted, at, 0.0)
+            rows_sorted = np.insert(rows_sorted, at, zero_rows[0])
+            y_sorted = np.insert(y_sorted, at, np.sum(zero_y))
+            y2_sorted = np.insert(y2_sorted, at, np.dot(zero_y, zero_y))
+            n_entries = np.insert(n_entries, at, n_zeros)
+        # a candidate ends where the next sorted value differs; the largest
+        # value only leaves the right group non-empty when values are missing
+        ends = np.flatnonzero(x_sorted[:-1] != x_sorted[1:])
+        if n_missing and len(x_sorted):
+            ends = np.append(ends, len(x_sorted) - 1)
+        if len(ends) == 0:
+            return np.empty(0), np.empty(0), np.empty(0, dtype=np.intp), np.empty(0, dtype=bool)
+        sum_y = np.cumsum(y_sorted)
+        sum_y2 = np.cumsum(y2_sorted)
+        n_left = ends + 1.0 if len(n_entries) == len(positions) else np.cumsum(n_entries)[ends]
+        n_right = n - n_missing - n_left
+        left_y, left_y2 = sum_y[ends], sum_y2[ends]
+        right_y, right_y2 = sum_y[-1] - left_y, sum_y2[-1] - left_y2
+        missing_left = np.zeros(len(ends), dtype=bool)
+        if not n_missing:
+            errors = (left_y2 - left_y * left_y / n_left) + (right_y2 - right_y * right_y / n_right)
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                n_right_with = n_right + n_missing
+                errors = (left_y2 - left_y * left_y / n_left) + \
+                         (right_y2 + missing_sum2 - (right_y + missing_sum) ** 2 / n_right_with)
+                n_left_with = n_left + n_missing
+                errors_left = (left_y2 + missing_sum2 - (left_y + missing_sum) ** 2 / n_left_with) + \
+                              (right_y2 - right_y * right_y / n_right)
+            # missing values only go left when that is strictly better
+            missing_left = (n_right > 0) & (errors_left < errors)
+            errors = np.where(missing_left, errors_left, errors)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        # only the candidates' own rows: past the last end lie the largest
+        # value's rows, which no candidate owns
+        first_rows = np.minimum.reduceat(rows_sorted[:ends[-1] + 1], starts)
+        return errors, x_sorted[ends], first_rows, missing_left
+
+    def exact_error(self, x, y, s, missing_left=False):
+        '''
+        Reference error of threshold s, summed in row order as the original
+        one-candidate-at-a-time search did.
+        :return: error, left mean, right mean, left mask
+        '''
+        left_mask = x <= s
+        if missing_left:
+            left_mask |= np.isnan(x)
+        left_y, right_y = y[left_mask], y[~left_mask]
+        c1, c2 = np.mean(left_y), np.mean(right_y)
+        error = np.cumsum((left_y - c1)*(left_y - c1))[-1] + np.cumsum((right_y - c2)*(right_y - c2))[-1]
+        return error, c1, c2, left_mask
+
+    def split_data(self, start, end):
+        '''
+        Best split of the node slice self.index[start:end]. All thresholds of a
+        feature are scored at once from prefix sums, and candidates tied within
+        rounding are re-scored exactly in row order, so the split matches the
+        one-candidate-at-a-time search. The exception is nodes with more than
+        max_exact_ties tied candidates, such as nodes with constant y: there the
+        approximate errors are ranked to keep the search linear, and the chosen
+        threshold, so also the subtree below it and its leaf means, can differ
+        from that search.
+        :return: the split, with the (start, end) slices of both groups
+        '''
+        rows = self.index[start:end]
+        y = self.y[rows]
         split_variable = 0
         split_threshold = 0
+        split_missing_left = False
         left_mean = 0
         right_mean = 0
-        my_left_data = []
-        my_right_data = []
-        for j in range(data.shape[1]-1):
-            x_j = data[:,j]
-            for i in range(len(x_j)):
-                # threshold
-                s = x_j[i]
-                left_data, right_data = self.get_groups(j, s, data)
-                if len(left_data) > 0 and len(right_data) > 0:
-                    left_y, right_y = left_data[:,-1], right_data[:,-1]
-                    
-                    c1, c2 = np.mean(left_y), np.mean(right_y)
-                    error = sum((left_y - c1)*(left_y - c1)) + sum((right_y - c2)*(right_y - c2))
-                    if error < min_error:
-                        min_error, split_variable, split_threshold, left_mean, right_mean, my_left_data, my_right_data = \
-                            error, j, s, c1, c2, left_data, right_data
+        my_groups = [(start, start), (end, end)]
+
+        # prefix sums are taken on centered labels to keep cancellation small
+        y_centered = y - np.mean(y)
+        tolerance = 1e-9 * np.dot(y_centered, y_centered) + np.finfo(float).tiny
+        # only candidates within tolerance of the running minimum are kept
+        min_error = None
+        near = []
+        n_candidates = 0
+
+        def scan(j):
+            x, positions = self.feature_values(rows, j)
+            return self.scan_feature(x, y_centered, positions)
 
+        for j, (errors, thresholds, first_rows, missing_left) in zip(self.features, self.map_features(scan, len(rows))):
+            n_candidates += len(errors)
+            if len(errors) == 0:
+                continue
+            if min_error is None or errors.min() < min_error:
+                min_error = errors.min()
+            keep = errors <= min_error + tolerance
+            near.append((j, errors[keep], thresholds[keep], first_rows[keep], missing_left[keep]))
+
+        if min_error is not None:
+            # Candidates that are tied within rounding of the prefix sums are
+            # re-scored exactly and ranked by (error, feature, first row), which
+            # reproduces the first-strictly-smaller rule of a serial scan.
+            # Degenerate nodes (e.g. constant y) tie everywhere; there the
+            # approximate errors are used directly to keep the scan linear,
+            # which can pick another threshold than the serial scan.
+            ties = [(j, errors[k], thresholds[k], first_rows[k], missing_left[k])
+                    for j, errors, thresholds, first_rows, missing_left in near
+                    for k in np.flatnonzero(errors <= min_error + tolerance)]
+            best = None
+            for j, error, threshold, first_row, missing_left in ties:
+                if len(ties) <= self.max_exact_ties:
+                    error = self.exact_error(self.dense_values(rows, j), y, threshold, missing_left)[0]
+                key = (error, j, first_row, missing_left)
+                if best is None or key < best[0]:
+                    best = (key, threshold)
+            (_, split_variable, _, split_missing_left), split_threshold = best
+            _, left_mean, right_mean, left_mask = self.exact_error(self.dense_values(rows, split_variable), y,
+                                                                   split_threshold, split_missing_left)
+            my_groups = self.partition(start, end, left_mask)
+
+        if self.telemetry is not None:
+            self.telemetry.add(candidates=n_candidates)
         return {'splitting_variable': split_variable, 'splitting_threshold': split_threshold,
-                'left': left_mean, 'right': right_mean, 'groups': [my_left_data, my_right_data]}
+                'left': left_mean, 'right': right_mean, 'groups': my_groups, 'missing_left': split_missing_left}
 
-    def split(self, node, depth):
-        groups = node['groups']
-        del node['groups']
+    def add_node(self, table, feature=-1, threshold=np.nan, value=np.nan, missing_left=False):
+        for column, item in zip(table, [feature, threshold, -1, -1, value, missing_left]):
+            column.append(item)
+        return len(table[0]) - 1
 
-        if depth == self.max_depth:
+    def build(self, start, end, depth, hist=None, dispatch=False):
+        '''
+        Grow the subtree of one node slice with an explicit stack instead of
+        recursion.
+        :param hist: histogram of the node in binned mode, None for the exact search
+        :param dispatch: whether large subtrees from dispatch_depth down are
+        handed to the worker pool; they cover disjoint index slices so they
+        can be partitioned concurrently
+        :return: the subtree as node table columns feature, threshold, left,
+        right, value and missing_left, type: lists, with node ids local to the
+        subtree
+        '''
+        table = [[], [], [], [], [], []]
+        _, _, left, right, _, _ = table
+        subtrees = []
+        # stack entries: parent node, child column of the parent, node slice, depth, histogram
+        stack = [(None, None, start, end, depth, hist)]
+        while stack:
+            parent, children, start, end, depth, hist = stack.pop()
+            if self.telemetry is not None:
+                search_start = time.perf_counter()
+            if hist is None:
+                node = self.split_data(start, end)
+            else:
+                node = self.split_data_binned(start, end, hist)
+            if self.telemetry is not None:
+                self.telemetry.add(split_seconds=time.perf_counter() - search_start)
+            node_id = self.add_node(table, node['splitting_variable'], node['splitting_threshold'],
+                                    missing_left=node['missing_left'])
+            if parent is not None:
+                children[parent] = node_id
+
+            groups = node['groups']
+            sizes = [group_end - group_start for group_start, group_end in groups]
+            grow = [depth != self.max_depth and size >= self.min_samples_split for size in sizes]
+            hists = [None, None]
+            if hist is not None and all(grow):
+                # only the smaller child is histogrammed; the sibling is parent minus it
+                small = 0 if sizes[0] <= sizes[1] else 1
+                hists[small] = self.histogram(*groups[small])
+                hists[1 - small] = (hist[0] - hists[small][0], hist[1] - hists[small][1])
+            elif hist is not None:
+                hists = [self.histogram(*group) if g else None for group, g in zip(groups, grow)]
+
+            leaf_groups = groups
+            if sum(sizes) < end - start:
+                # no valid split, yet predict still routes these rows to one of
+                # the two leaves; both hold 0, so in binned mode the upper edge
+                # of each row's bin is enough to pick the side
+                j, rows = node['splitting_variable'], self.index[start:end]
+                if hist is None:
+                    x = self.dense_values(rows, j)
+                else:
+                    x = decode(self.codes[rows, j:j + 1], self.edges[j:j + 1])[:, 0]
+                leaf_groups = self.partition(start, end, x <= node['splitting_threshold'])
+
+            for side, children, mean in [(1, right, node['right']), (0, left, node['left'])]:
+                group_start, group_end = groups[side]
+                if grow[side] and dispatch and depth + 1 >= self.dispatch_depth \
+                        and sizes[side] >= self.min_subtree_rows:
+                    future = self.pool.submit(self.build, group_start, group_end, depth+1, hists[side])
+                    subtrees.append((node_id, children, group_start, group_end, future))
+                elif grow[side]:
+                    stack.append((node_id, children, group_start, group_end, depth+1, hists[side]))
+                else:
+                    children[node_id] = self.add_node(table, value=mean)
+                    leaf_start, leaf_end = leaf_groups[side]
+                    self.train_leaves[self.index[leaf_start:leaf_end]] = children[node_id]
+
+        # splice the dispatched subtrees in behind this one, shifting their ids
+        for parent, children, start, end, future in subtrees:
+            subtree = future.result()
+            offset = len(table[0])
+            children[parent] = offset
+            for column, sub_column in zip(table, subtree):
+                column.extend(sub_column)
+            for column in (left, right):
+                column[offset:] = [child + offset if child >= 0 else child for child in column[offset:]]
+            self.train_leaves[self.index[start:end]] += offset
+        return table
+
+    def split(self, hist=None):
+        '''
+        Grow the tree from the root into the flat node table.
+        :param hist: root histogram in binned mode, None for the exact search
+        '''
+        self.train_leaves = np.full(len(self.y), -1, dtype=np.intp)
+        dispatch = self.pool is not None and self.parallel_subtrees
+        table = self.build(0, len(self.index), 1, hist, dispatch)
+        if self.telemetry is not None:
+            leaves = table[0].count(-1)
+            self.telemetry.add(nodes=len(table[0]) - leaves, leaves=leaves)
+        self.feature = np.array(table[0], dtype=np.intp)
+        self.threshold = np.array(table[1], dtype=float)
+        self.left = np.array(table[2], dtype=np.intp)
+        self.right = np.array(table[3], dtype=np.intp)
+        self.value = np.array(table[4], dtype=float)
+        self.missing_left = np.array(table[5], dtype=bool)
+
+    def map_features(self, function, n_rows):
+        '''
+        Apply function to every searched feature and yield the results in
+        feature order, on the worker pool for large enough nodes. Features are
+        dispatched in small batches so only a few results are held at once.
+        '''
+        # subtree workers scan serially; only the thread that owns the pool
+        # fans out, so no worker ever waits on a task queued behind it
+        if self.pool is None or n_rows < self.min_parallel_rows or threading.get_ident() != self.pool_owner:
+            for j in self.features:
+                yield function(j)
             return
-        else:
-            if len(groups[0]) >= self.min_samples_split:
-                node['left'] = self.split_data(groups[0])
-                self.split(node['left'], depth+1)
-            if len(groups[1]) >= self.min_samples_split:
-                node['right'] = self.split_data(groups[1])
-                self.split(node['right'], depth+1)
+        features = list(self.features)
+        batch = 2 * self.n_workers
+        for start in range(0, len(features), batch):
+            for result in self.pool.map(function, features[start:start + batch]):
+                yield result
+
+    def prepare(self, y, rows, features, num_feature):
+        self.y = np.asarray(y, dtype=float)
+        # nodes are slices of one index permutation over the training rows
+        self.index = np.arange(len(self.y)) if rows is None else np.sort(rows)
+        self.features = range(num_feature) if features is None else np.sort(features)
+        self.n_workers = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        if self.n_workers is not None and self.n_workers > 1:
+            self.pool = ThreadPoolExecutor(self.n_workers)
+            self.pool_owner = threading.get_ident()
+            # expand the top levels on this thread until there are about as
+            # many subtrees as workers
+            self.dispatch_depth = 1 + int(np.ceil(np.log2(self.n_workers)))
 
-    def fit(self, X, y):
+    def finish(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.span is not None:
+            self.telemetry.end(self.span, 'tree', rows=len(self.index))
+            self.span = None
+        self.X = self.codes = self.y = self.index = None
+
+    def fit(self, X, y, rows=None, features=None):
         '''
         Inputs:
-        X: Train feature data, type: numpy array, shape: (N, num_feature)
+        X: Train feature data, type: numpy array or scipy.sparse matrix, shape: (N, num_feature)
         Y: Train label data, type: numpy array, shape: (N,)
+        rows: optional indexes of the rows to fit on, by default all of them
+        features: optional indexes of the features searched for splits, by
+        default all of them
 
-        You should update the self.root in this function.
+        You should update the node table in this function.
         '''
-        y = np.reshape(y, (len(y), 1))
-        data = np.append(X, y, axis=1)
-        self.root = self.split_data(data)
-        self.split(self.root, 1)
-
-    def traverse_tree(self, node, x):
-        if isinstance(node, float):
-            return node
-        if x[node['splitting_variable']] <= node['splitting_threshold']:
-            return self.traverse_tree(node['left'], x)
+        if self.telemetry is not None:
+            self.span = self.telemetry.begin()
+        if self.binning:
+            codes, edges = quantize(X, self.binning)
+            self.fit_binned(codes, edges, y, rows, features)
+            return
+        # X and y are shared read-only
+        self.sparse = is_sparse(X)
+        if self.sparse:
+            self.X = X.tocsc()
+            if not self.X.has_sorted_indices:
+                self.X = self.X.sorted_indices()
         else:
-            return self.traverse_tree(node['right'], x)
+            self.X = np.asarray(X).view()
+            self.X.flags.writeable = False
+        self.prepare(y, rows, features, self.X.shape[1])
+        try:
+            self.split()
+        finally:
+            self.finish()
+
+    def histogram(self, start, end):
+        '''
+        :return: per-feature sums of y and row counts over the bins, for the
+        rows of the node slice, type: numpy arrays, shape: (num_feature, num_bins)
+        '''
+        if self.telemetry is not None:
+            histogram_start = time.perf_counter()
+        # the last bin of every feature holds its missing values
+        n_bins = self.missing_code + 1
+        rows = self.index[start:end]
+        y_rows = self.y[rows]
+        # features outside self.features keep empty histograms and never split
+        sums = np.zeros((self.codes.shape[1], n_bins))
+        counts = np.zeros((self.codes.shape[1], n_bins), dtype=np.int64)
+
+        def feature_histogram(j):
+            codes_j = self.codes[rows, j]
+            return np.bincount(codes_j, weights=y_rows, minlength=n_bins), np.bincount(codes_j, minlength=n_bins)
+
+        for j, (feature_sums, feature_counts) in zip(self.features, self.map_features(feature_histogram, len(rows))):
+            sums[j], counts[j] = feature_sums, feature_counts
+        if self.telemetry is not None:
+            self.telemetry.add(histogram_seconds=time.perf_counter() - histogram_start)
+        return sums, counts
+
+    def split_data_binned(self, start, end, hist):
+        split_variable = 0
+        split_threshold = 0
+        split_missing_left = False
+        left_mean = 0
+        right_mean = 0
+        my_groups = [(start, start), (end, end)]
+
+        sums, counts = hist
+        missing_y, n_missing = sums[:, -1:], counts[:, -1:]
+        left_y, n_left = np.cumsum(sums[:, :-1], axis=1), np.cumsum(counts[:, :-1], axis=1)
+        right_y, n_right = left_y[:, -1:] - left_y + missing_y, n_left[:, -1:] - n_left + n_missing
+        # minimizing the SSE is maximizing sum(left)^2/n_left + sum(right)^2/n_right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = np.where((n_left > 0) & (n_right > 0),
+                            left_y * left_y / n_left + right_y * right_y / n_right, -np.inf)
+            missing_left = np.zeros(gain.shape, dtype=bool)
+            if n_missing.any():
+                # the same thresholds with the missing bin moved to the left
+                left_y, n_left = left_y + missing_y, n_left + n_missing
+                right_y, n_right = right_y - missing_y, n_right - n_missing
+                gain_left = np.where((n_missing > 0) & (n_right > 0),
+                                     left_y * left_y / n_left + right_y * right_y / n_right, -np.inf)
+                missing_left = gain_left > gain
+                gain = np.where(missing_left, gain_left, gain)
+        if self.telemetry is not None:
+            self.telemetry.add(candidates=np.count_nonzero(np.isfinite(gain)))
+        if np.isfinite(gain).any():
+            # argmax returns the first maximum: lowest feature, then lowest bin
+            split_variable, k = np.unravel_index(np.argmax(gain), gain.shape)
+            split_variable = int(split_variable)
+            split_threshold = self.edges[split_variable][k]
+            split_missing_left = bool(missing_left[split_variable, k])
+            codes = self.codes[self.index[start:end], split_variable]
+            left_mask = codes <= k
+            if split_missing_left:
+                left_mask |= codes == self.missing_code
+            my_groups = self.partition(start, end, left_mask)
+            (left_start, mid), (_, right_end) = my_groups
+            left_mean = np.mean(self.y[self.index[left_start:mid]])
+            right_mean = np.mean(self.y[self.index[mid:right_end]])
+
+        return {'splitting_variable': split_variable, 'splitting_threshold': split_threshold,
+                'left': left_mean, 'right': right_mean, 'groups': my_groups, 'missing_left': split_missing_left}
+
+    def fit_binned(self, codes, edges, y, rows=None, features=None):
+        '''
+        Fit on pre-quantized features, so an ensemble can bin X only once.
+        :param codes: bin codes from quantize, type: numpy array of uint8, shape: (N, num_feature)
+        :param edges: bin edges from quantize, the splitting thresholds
+        :param y: Train label data, type: numpy array, shape: (N,)
+        :param rows, features: optional row and feature subsets as in fit
+        '''
+        if self.telemetry is not None and self.span is None:
+            self.span = self.telemetry.begin()
+        self.codes = np.asarray(codes).view()
+        self.codes.flags.writeable = False
+        self.edges = edges
+        self.missing_code = max(len(e) for e in edges)
+        self.prepare(y, rows, features, self.codes.shape[1])
+        try:
+            self.split(self.histogram(0, len(self.index)))
+        finally:
+            self.finish()
+
+    def fit_from_files(self, x_file, y_file, chunk_rows=65536, delimiter=',', codes_file=None):
+        '''
+        Fit a histogram tree on data files that need not fit in memory. The
+        features are streamed through quantize_file, with binning bins or 255
+        if it is not set, and only the uint8 codes and the labels are kept.
+        :param x_file, y_file: .npy or delimited text files, see read_chunks
+        :param codes_file: optional .npy file to memory-map the codes from
+        '''
+        codes, edges = quantize_file(x_file, self.binning or 255, chunk_rows, delimiter, codes_file)
+        self.fit_binned(codes, edges, read_labels(y_file, chunk_rows, delimiter))
 
     def predict(self, X):
         '''
         :param X: Feature data, type: numpy array, shape: (N, num_feature)
         :return: y_pred: Predicted label, type: numpy array, shape: (N,)
         '''
-        y_pred = []
-        for x in X:
-            y_pred.append(self.traverse_tree(self.root, x))
-        return y_pred
+        return self.value[self.apply(X)]
+
+    def apply(self, X):
+        '''
+        :param X: Feature data, type: numpy array or scipy.sparse matrix, shape: (N, num_feature)
+        :return: index of the leaf node each row ends in, type: numpy array, shape: (N,)
+        '''
+        if is_sparse(X):
+            # densify a block of rows at a time
+            X = X.tocsr()
+            blocks = [self.apply(X[start:start + 65536].toarray()) for start in range(0, X.shape[0], 65536)]
+            return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.intp)
+        X = np.asarray(X)
+        node = np.zeros(len(X), dtype=np.intp)
+        # route the whole batch one level at a time until every row is at a leaf
+        rows = np.flatnonzero(self.feature[node] >= 0)
+        while len(rows):
+            at = node[rows]
+            x = X[rows, self.feature[at]]
+            go_left = (x <= self.threshold[at]) | (np.isnan(x) & self.missing_left[at])
+            node[rows] = np.where(go_left, self.left[at], self.right[at])
+            rows = rows[self.feature[node[rows]] >= 0]
+        return node
 
     def get_model_string(self):
-        model_dict = self.root
+        '''
+        :return: the nested dictionary form of the tree; leaves are floats. A
+        node only has a 'missing_left': True entry when it sends missing values
+        left.
+        '''
+        if self.feature is None:
+            return None
+        model_dict = {}
+        stack = [(0, model_dict)]
+        while stack:
+            node, node_dict = stack.pop()
+            node_dict['splitting_variable'] = int(self.feature[node])
+            node_dict['splitting_threshold'] = self.threshold[node]
+            if self.missing_left[node]:
+                node_dict['missing_left'] = True
+            for key, child in [('left', self.left[node]), ('right', self.right[node])]:
+                if self.feature[child] < 0:
+                    node_dict[key] = self.value[child]
+                else:
+                    node_dict[key] = {}
+                    stack.append((child, node_dict[key]))
         return model_dict
 
+    @property
+    def root(self):
+        return self.get_model_string()
+
     def save_model_to_json(self, file_name):
-        model_dict = self.root
+        model_dict = self.get_model_string()
         with open(file_name, 'w') as fp:
             json.dump(model_dict, fp)
 
+    @classmethod
+    def from_json(cls, model_dict):
+        '''
+        Rebuild a fitted tree from the nested dictionary of get_model_string,
+        compiling it straight into the node table.
+        :param model_dict: type: dictionary, leaves of 'left'/'right' are numbers
+        '''
+        tree = cls()
+        table = [[], [], [], [], [], []]
+        _, _, left, right, _, _ = table
+        stack = [(model_dict, None, None)]
+        while stack:
+            node_dict, parent, children = stack.pop()
+            node = tree.add_node(table, int(node_dict['splitting_variable']), float(node_dict['splitting_threshold']),
+                                 missing_left=bool(node_dict.get('missing_left', False)))
+            if parent is not None:
+                children[parent] = node
+            for key, children in [('right', right), ('left', left)]:
+                if isinstance(node_dict[key], dict):
+                    stack.append((node_dict[key], node, children))
+                else:
+                    children[node] = tree.add_node(table, value=float(node_dict[key]))
+        tree.feature = np.array(table[0], dtype=np.intp)
+        tree.threshold = np.array(table[1], dtype=float)
+        tree.left = np.array(table[2], dtype=np.intp)
+        tree.right = np.array(table[3], dtype=np.intp)
+        tree.value = np.array(table[4], dtype=float)
+        tree.missing_left = np.array(table[5], dtype=bool)
+        return tree
+
+    @classmethod
+    def load_model_from_json(cls, file_name):
+        '''
+        :return: a tree rebuilt from a file written by save_model_to_json
+        '''
+        with open(file_name, 'r') as fp:
+            return cls.from_json(json.load(fp))
+
+    def save_model(self, file_name):
+        '''
+        Save the node table in the binary model format, see write_model.
+        '''
+        write_model(file_name, MODEL_TREE, [0],
+                    [self.feature, self.threshold, self.left, self.right, self.value, self.missing_left])
+
+    @classmethod
+    def load_model(cls, file_name):
+        '''
+        :return: a tree whose node table is memory-mapped from a file written by save_model
+        '''
+        header, _, columns, _ = read_model(file_name)
+        if header['kind'] != MODEL_TREE:
+            raise ValueError("%s does not hold a single tree" % file_name)
+        tree = cls()
+        tree.feature, tree.threshold, tree.left, tree.right, tree.value, tree.missing_left = columns
+        return tree
+
 
 # For test
 if __name__=='__main__':
@@ -135,3 +1015,56 @@ if __name__=='__main__':
             y_test_pred = np.genfromtxt("Test_data" + os.sep + "y_pred_decision_tree_"  + str(i) + "_" + str(j) + ".csv", delimiter=",")
             print(np.square(y_pred - y_test_pred).mean() <= 10**-10)
 
+            # round trip through the binary model format
+            with tempfile.TemporaryDirectory() as model_dir:
+                tree.save_model(os.path.join(model_dir, "tree.bin"))
+                loaded = MyDecisionTreeRegressor.load_model(os.path.join(model_dir, "tree.bin"))
+                print(operator.eq(loaded.get_model_string(), test_model_string) and
+                      np.array_equal(loaded.predict(x_train), y_pred))
+                del loaded
+
+            # rebuild the predictor from the saved JSON model
+            loaded = MyDecisionTreeRegressor.load_model_from_json(
+                "Test_data" + os.sep + "decision_tree_" + str(i) + "_" + str(j) + ".json")
+            print(np.array_equal(loaded.predict(x_train), y_pred))
+
+            # accuracy gap of histogram-binned training against exact mode
+            exact_mse = np.square(y_pred - y_train).mean()
+            for binning in [255, 16]:
+                tree = MyDecisionTreeRegressor(max_depth=5, min_samples_split=j + 2, binning=binning)
+                tree.fit(x_train, y_train)
+                binned_mse = np.square(np.array(tree.predict(x_train)) - y_train).mean()
+                print("binning=%d: exact mse %.6g, binned mse %.6g, gap %.6g" %
+                      (binning, exact_mse, binned_mse, binned_mse - exact_mse))
+
+                # the same tree trained from the files, streamed a few rows at a time
+                streamed = MyDecisionTreeRegressor(max_depth=5, min_samples_split=j + 2, binning=binning)
+                streamed.fit_from_files("Test_data" + os.sep + "x_" + str(i) + ".csv",
+                                        "Test_data" + os.sep + "y_" + str(i) + ".csv", chunk_rows=3)
+                print(operator.eq(streamed.get_model_string(), tree.get_model_string()))
+
+
+    # empty cells of a streamed file are missing values, as in the in-memory fit
+    with open("Test_data" + os.sep + "x_0.csv", 'r') as fp:
+        lines = fp.read().splitlines()
+    lines = [",".join("" if (k + i) % 7 == 0 else cell for k, cell in enumerate(line.split(",")))
+             for i, line in enumerate(lines)]
+    with tempfile.TemporaryDirectory() as data_dir:
+        x_file = os.path.join(data_dir, "x_missing.csv")
+        with open(x_file, 'w') as fp:
+            fp.write("\n".join(lines) + "\n")
+        x_train = np.genfromtxt(x_file, delimiter=",")
+        y_train = np.genfromtxt("Test_data" + os.sep + "y_0.csv", delimiter=",")
+        tree = MyDecisionTreeRegressor(max_depth=5, min_samples_split=2, binning=255)
+        tree.fit(x_train, y_train)
+        streamed = MyDecisionTreeRegressor(max_depth=5, min_samples_split=2, binning=255)
+        streamed.fit_from_files(x_file, "Test_data" + os.sep + "y_0.csv", chunk_rows=3)
+        print(np.isnan(x_train).any() and operator.eq(streamed.get_model_string(), tree.get_model_string()))
+
+    # splitting at -0.8 and at -0.1 give the same error; the tie goes to the
+    # threshold whose rows come first, as in the one-candidate-at-a-time search
+    tree = MyDecisionTreeRegressor(max_depth=1)
+    tree.fit(np.array([[0.5], [-0.8], [-0.1], [-0.4]]), np.array([6e5, 2e5, 3e5, 5e5]))
+    print(operator.eq(tree.get_model_string(), {'splitting_variable': 0, 'splitting_threshold': -0.8,
+                                                'left': 200000.0, 'right': 1400000.0 / 3}))
+
@@ -1,12 +1,17 @@
 import numpy as np
-from DecisionTreeRegressor import MyDecisionTreeRegressor
+import time
+from DecisionTreeRegressor import MyDecisionTreeRegressor, quantize, quantize_file, read_labels, decode, \
+    write_model, read_model, is_sparse, MODEL_ENSEMBLE
 import os
+import tempfile
 import json
 import operator
 
 
 class MyGradientBoostingRegressor():
-    def __init__(self, learning_rate=0.1, n_estimators=100, max_depth=5, min_samples_split=1):
+    def __init__(self, learning_rate=0.1, n_estimators=100, max_depth=5, min_samples_split=1, binning=None,
+                 subsample=1.0, max_features=1.0, random_state=None, validation_fraction=0.1,
+                 n_iter_no_change=None, tol=1e-4, n_jobs=None, parallel_subtrees=False, telemetry=None):
         '''
         Initialization
         :param learning_rate: type:float
@@ -24,59 +29,344 @@ class MyGradientBoostingRegressor():
         of the input variables.
         :param min_samples_split: type: integer
         minimum number of samples required to split an internal node
+        :param binning: type: integer or None
+        when set, X is quantized once into at most this many bins per
+        feature and every stage fits a histogram tree on the shared codes.
+        None fits exact trees.
+        :param subsample: type: float
+        fraction of the rows, drawn without replacement, that each stage
+        fits its tree on. 1.0 uses every row.
+        :param max_features: type: float
+        fraction of the features each stage searches for splits. 1.0 uses
+        every feature.
+        :param random_state: type: integer or None
+        seed of the random generator used for row and feature sampling.
+        :param validation_fraction: type: float
+        fraction of the rows held out to decide early stopping. Only used
+        when n_iter_no_change is set.
+        :param n_iter_no_change: type: integer or None
+        stop training once the validation loss has not improved by more than
+        tol for this many consecutive stages. None trains all n_estimators.
+        :param tol: type: float
+        smallest decrease of the validation mean squared error that counts
+        as an improvement.
+        :param n_jobs: type: integer or None
+        number of worker threads each tree uses to search features for splits
+        in parallel; -1 uses every core. None searches serially.
+        :param parallel_subtrees: type: boolean
+        with n_jobs, also build independent subtrees on the worker pool.
+        :param telemetry: type: Telemetry or None
+        when set, fit records a 'quantize' event in binned mode, a 'tree'
+        and a 'stage' event per stage and a final 'fit' event. Stage records
+        hold the tree's counters, update_seconds spent routing rows and
+        updating the scores, and the train_loss and validation_loss (mean
+        squared errors) after the stage.
 
-        estimators: the regression estimators
+        estimators: the regression estimators, truncated to the stages that
+        were fitted when early stopping ends training before n_estimators
+        validation_loss: type: list, the validation mean squared error after
+        each stage when early stopping is enabled
+        feature, threshold, left, right, value, missing_left, roots: type: numpy arrays, the
+        compiled ensemble, one node table holding every tree with leaf values
+        already scaled by learning_rate, and the index of each tree's root.
+        Leaves point back to themselves so every row can take the same number
+        of steps, depth, through the table. n_features_used is one more than
+        the largest feature index any tree splits on.
         '''
         self.learning_rate = learning_rate
         self.n_estimators = n_estimators
-        self.estimators = np.empty((self.n_estimators,), dtype=np.object)
+        self.estimators = np.empty((self.n_estimators,), dtype=object)
         self.max_depth = max_depth
         self.min_samples_split = min_samples_split
+        self.binning = binning
+        self.subsample = subsample
+        self.max_features = max_features
+        self.random_state = random_state
+        self.validation_fraction = validation_fraction
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.n_jobs = n_jobs
+        self.parallel_subtrees = parallel_subtrees
+        self.telemetry = telemetry
+        self.validation_loss = []
         self.f0 = 0
+        self.roots = None
+        self.max_batch_nodes = 2 ** 20
 
     def fit(self, X, y):
         '''
         Inputs:
-        X: Train feature data, type: numpy array, shape: (N, num_feature)
+        X: Train feature data, type: numpy array or scipy.sparse matrix, shape: (N, num_feature)
         Y: Train label data, type: numpy array, shape: (N,)
 
         You should update the self.estimators in this function
         '''
-        f = np.mean(y)
+        if self.binning:
+            span = None if self.telemetry is None else self.telemetry.begin()
+            codes, edges = quantize(X, self.binning)
+            if span is not None:
+                self.telemetry.end(span, 'quantize', rows=len(codes))
+            self.fit_stages(None, y, codes, edges)
+            return
+        if is_sparse(X):
+            # convert once instead of in every stage's tree
+            X = X.tocsc()
+            X.sort_indices()
+        self.fit_stages(X, y)
+
+    def fit_binned(self, codes, edges, y):
+        '''
+        Fit on pre-quantized features, see quantize and
+        MyDecisionTreeRegressor.fit_binned.
+        '''
+        self.fit_stages(None, y, codes, edges)
+
+    def fit_from_files(self, x_file, y_file, chunk_rows=65536, delimiter=',', codes_file=None):
+        '''
+        Fit histogram trees on data files that need not fit in memory, see
+        MyDecisionTreeRegressor.fit_from_files. The features are streamed
+        once to find the bins and once to encode them.
+        '''
+        span = None if self.telemetry is None else self.telemetry.begin()
+        codes, edges = quantize_file(x_file, self.binning or 255, chunk_rows, delimiter, codes_file)
+        if span is not None:
+            self.telemetry.end(span, 'quantize', rows=len(codes))
+        self.fit_stages(None, read_labels(y_file, chunk_rows, delimiter), codes, edges)
+
+    def fit_stages(self, X, y, codes=None, edges=None):
+        '''
+        The boosting loop, on float features X or, when X is None, on the
+        bin codes and edges of quantize.
+        '''
+        y = np.asarray(y)
+        fit_span = None if self.telemetry is None else self.telemetry.begin()
+        rng = np.random.RandomState(self.random_state)
+        n_samples, n_features = np.shape(X if codes is None else codes)
+        # with sampling and early stopping off no random draws are made
+        rows, features, train_rows, validation_rows = None, None, None, None
+        if self.n_iter_no_change is not None:
+            permutation = rng.permutation(n_samples)
+            n_validation = max(1, int(self.validation_fraction * n_samples))
+            train_rows, validation_rows = permutation[n_validation:], permutation[:n_validation]
+            rows = train_rows
+        self.validation_loss = []
+        best_loss, stages_no_change = np.inf, 0
+
+        f = np.mean(y) if train_rows is None else np.mean(y[train_rows])
         self.f0 = f
+        self.estimators = np.empty((self.n_estimators,), dtype=object)
         for i in range(self.n_estimators):
+            if self.subsample < 1.0:
+                pool = np.arange(n_samples) if train_rows is None else train_rows
+                rows = pool[rng.choice(len(pool), max(1, int(self.subsample * len(pool))), replace=False)]
+            if self.max_features < 1.0:
+                features = rng.choice(n_features, max(1, int(self.max_features * n_features)), replace=False)
+            if self.telemetry is not None:
+                span = self.telemetry.begin()
             residual = y - f
-            estimator = MyDecisionTreeRegressor(max_depth=self.max_depth, min_samples_split=self.min_samples_split)
-            estimator.fit(X, residual)
-            f = f + self.learning_rate * np.array(estimator.predict(X))
+            estimator = MyDecisionTreeRegressor(max_depth=self.max_depth, min_samples_split=self.min_samples_split,
+                                                binning=self.binning, n_jobs=self.n_jobs,
+                                                parallel_subtrees=self.parallel_subtrees, telemetry=self.telemetry)
+            if codes is None:
+                estimator.fit(X, residual, rows, features)
+            else:
+                estimator.fit_binned(codes, edges, residual, rows, features)
+            if self.telemetry is not None:
+                update_start = time.perf_counter()
+            # the tree already knows the leaf of every row it was fit on
+            leaves = estimator.train_leaves
+            unseen = np.flatnonzero(leaves < 0)
+            if codes is None:
+                if len(unseen):
+                    leaves[unseen] = estimator.apply(X[unseen])
+            else:
+                # the rest are routed on their bins, a block at a time
+                for start in range(0, len(unseen), 65536):
+                    block = unseen[start:start + 65536]
+                    leaves[block] = estimator.apply(decode(codes[block], edges))
+            f = f + self.learning_rate * estimator.value[leaves]
+            estimator.train_leaves = None
             self.estimators[i] = estimator
+            if self.telemetry is not None:
+                update_seconds = time.perf_counter() - update_start
+
+            loss = None
+            if validation_rows is not None:
+                # held-out rows were routed above, so f already scores them
+                loss = np.mean(np.square(y[validation_rows] - f[validation_rows]))
+                self.validation_loss.append(loss)
+            if self.telemetry is not None:
+                fitted = slice(None) if train_rows is None else train_rows
+                self.telemetry.end(span, 'stage', stage=i, update_seconds=update_seconds,
+                                   train_loss=np.mean(np.square(y[fitted] - f[fitted])), validation_loss=loss)
+            if validation_rows is not None:
+                if loss < best_loss - self.tol:
+                    best_loss, stages_no_change = loss, 0
+                else:
+                    stages_no_change += 1
+                if stages_no_change >= self.n_iter_no_change:
+                    self.estimators = self.estimators[:i + 1]
+                    break
+        self.compile()
+        if fit_span is not None:
+            self.telemetry.end(fit_span, 'fit', rows=n_samples, stages=len(self.estimators))
+
+    def compile(self):
+        '''
+        Pack every estimator into one contiguous node table, so predict can
+        traverse all trees of the ensemble in a single batched pass.
+        '''
+        sizes = [len(estimator.feature) for estimator in self.estimators]
+        self.roots = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.intp)
+        feature = np.concatenate([estimator.feature for estimator in self.estimators])
+        # child links are shifted by each tree's offset
+        left = np.concatenate([estimator.left + root for estimator, root in zip(self.estimators, self.roots)])
+        right = np.concatenate([estimator.right + root for estimator, root in zip(self.estimators, self.roots)])
+        leaves = feature < 0
+        nodes = np.arange(len(feature))
+        self.n_features_used = int(np.max(feature, initial=-1)) + 1
+        self.feature = np.where(leaves, 0, feature)
+        self.threshold = np.where(leaves, np.inf, np.concatenate([e.threshold for e in self.estimators]))
+        self.left = np.where(leaves, nodes, left)
+        self.right = np.where(leaves, nodes, right)
+        self.value = np.concatenate([self.learning_rate * estimator.value for estimator in self.estimators])
+        self.missing_left = np.concatenate([estimator.missing_left for estimator in self.estimators]) & ~leaves
+        # the deepest leaf bounds the number of routing steps
+        self.depth = 0
+        frontier = self.roots[~leaves[self.roots]]
+        while len(frontier):
+            frontier = np.concatenate((left[frontier], right[frontier]))
+            frontier = frontier[~leaves[frontier]]
+            self.depth += 1
 
     def predict(self, X):
         '''
-        :param X: Feature data, type: numpy array, shape: (N, num_feature)
+        :param X: Feature data, type: numpy array or scipy.sparse matrix, shape: (N, num_feature)
         :return: y_pred: Predicted label, type: numpy array, shape: (N,)
         '''
+        if self.roots is None:
+            self.compile()
+        X = X.tocsr() if is_sparse(X) else np.asarray(X, dtype=float)
+        n_samples, n_features = X.shape
+        # rows are read from one flat array, where a missing column would
+        # silently read the next row's values
+        if n_features < self.n_features_used:
+            raise ValueError("X has %d features, but the model splits on feature %d" %
+                             (n_features, self.n_features_used - 1))
+        has_missing = self.missing_left.any()
+        y_pred = np.empty(n_samples)
+        # rows are scored in chunks so the (trees x rows) routing state stays bounded
+        chunk = max(1, self.max_batch_nodes // len(self.roots))
+        for start in range(0, n_samples, chunk):
+            X_chunk = X[start:start + chunk]
+            X_chunk = np.ascontiguousarray(X_chunk.toarray() if is_sparse(X_chunk) else X_chunk, dtype=float).ravel()
+            n = len(X_chunk) // n_features
+            node = np.repeat(self.roots, n)
+            offset = np.tile(np.arange(n) * n_features, len(self.roots))
+            for _ in range(self.depth):
+                x = X_chunk[offset + self.feature[node]]
+                go_left = x <= self.threshold[node]
+                if has_missing:
+                    go_left |= np.isnan(x) & self.missing_left[node]
+                node = np.where(go_left, self.left[node], self.right[node])
+            leaf_values = self.value[node].reshape(len(self.roots), n)
+            # stages are added in order so the sum matches stage-by-stage scoring
+            scores = self.f0 + leaf_values[0]
+            for stage_values in leaf_values[1:]:
+                scores += stage_values
+            y_pred[start:start + chunk] = scores
+        return y_pred
+
+    def staged_predict(self, X):
+        '''
+        :param X: Feature data, type: numpy array, shape: (N, num_feature)
+        :return: generator of the predictions after each stage, the last one
+        equal to predict(X)
+        '''
+        if not is_sparse(X):
+            X = np.asarray(X, dtype=float)
         y_pred = self.f0
         for estimator in self.estimators:
-            y_pred += self.learning_rate * np.array(estimator.predict(X))
-        return y_pred
-    	
-        
+            y_pred = y_pred + self.learning_rate * estimator.predict(X)
+            yield y_pred
 
     def get_model_string(self):
         model_dict = dict()
-        for i in range(self.n_estimators):
+        for i in range(len(self.estimators)):
             model_dict.update({str(i):self.estimators[i].root})
         return model_dict
 
     def save_model_to_json(self, file_name):
         model_dict = dict()
-        for i in range(self.n_estimators):
+        for i in range(len(self.estimators)):
             model_dict.update({str(i):self.estimators[i].root})
 
         with open(file_name, 'w') as fp:
             json.dump(model_dict, fp)
 
+    def save_model(self, file_name):
+        '''
+        Save the ensemble in the binary model format, see write_model: every
+        tree's own node table followed by the compiled table used by predict.
+        '''
+        if self.roots is None:
+            self.compile()
+        columns = [np.concatenate([getattr(estimator, name) for estimator in self.estimators])
+                   for name in ['feature', 'threshold', 'left', 'right', 'value', 'missing_left']]
+        compiled = [self.feature, self.threshold, self.left, self.right, self.value, self.missing_left]
+        write_model(file_name, MODEL_ENSEMBLE, self.roots, columns, compiled, self.depth, self.learning_rate, self.f0)
+
+    @classmethod
+    def from_json(cls, model_dict, f0, learning_rate=0.1):
+        '''
+        Rebuild a fitted ensemble from the dictionary of get_model_string and
+        compile it for predict.
+        :param model_dict: type: dictionary, one tree dictionary per stage keyed '0', '1', ...
+        :param f0: the initial prediction, the mean of the training labels;
+        the dictionary layout does not store it
+        :param learning_rate: the learning rate the ensemble was trained with
+        '''
+        model = cls(learning_rate=learning_rate, n_estimators=len(model_dict))
+        model.f0 = f0
+        for i in range(len(model_dict)):
+            model.estimators[i] = MyDecisionTreeRegressor.from_json(model_dict[str(i)])
+        model.compile()
+        return model
+
+    @classmethod
+    def load_model_from_json(cls, file_name, f0, learning_rate=0.1):
+        '''
+        :return: an ensemble rebuilt from a file written by save_model_to_json,
+        see from_json for f0 and learning_rate
+        '''
+        with open(file_name, 'r') as fp:
+            return cls.from_json(json.load(fp), f0, learning_rate)
+
+    @classmethod
+    def load_model(cls, file_name):
+        '''
+        :return: an ensemble whose trees and compiled table are memory-mapped
+        from a file written by save_model, ready to predict without compiling
+        '''
+        header, roots, columns, compiled = read_model(file_name)
+        if header['kind'] != MODEL_ENSEMBLE:
+            raise ValueError("%s does not hold an ensemble" % file_name)
+        model = cls(learning_rate=float(header['learning_rate']), n_estimators=len(roots))
+        model.f0 = float(header['f0'])
+        ends = list(roots[1:]) + [len(columns[0])]
+        for i, (start, end) in enumerate(zip(roots, ends)):
+            estimator = MyDecisionTreeRegressor()
+            estimator.feature, estimator.threshold, estimator.left, estimator.right, estimator.value, \
+                estimator.missing_left = \
+                [column[start:end] for column in columns]
+            model.estimators[i] = estimator
+        model.roots = roots
+        model.feature, model.threshold, model.left, model.right, model.value, model.missing_left = compiled
+        model.depth = int(header['depth'])
+        # the compiled table marks leaves with feature 0, the trees' own with -1
+        model.n_features_used = int(np.max(columns[0], initial=-1)) + 1
+        return model
+
 
 # For test
 if __name__=='__main__':
@@ -99,4 +389,34 @@ if __name__=='__main__':
 
             y_test_pred = np.genfromtxt("Test_data" + os.sep + "y_pred_gradient_boosting_"  + str(i) + "_" + str(j) + ".csv", delimiter=",")
             print(np.square(y_pred - y_test_pred).mean() <= 10**-10)
+
+            # round trip through the binary model format
+            with tempfile.TemporaryDirectory() as model_dir:
+                gbr.save_model(os.path.join(model_dir, "gbr.bin"))
+                loaded = MyGradientBoostingRegressor.load_model(os.path.join(model_dir, "gbr.bin"))
+                print(operator.eq(loaded.get_model_string(), test_model_string) and
+                      np.array_equal(loaded.predict(x_train), y_pred))
+                del loaded
+
+            # rebuild the predictor from the saved JSON model
+            loaded = MyGradientBoostingRegressor.load_model_from_json(
+                "Test_data" + os.sep + "gradient_boosting_" + str(i) + "_" + str(j) + ".json", np.mean(y_train))
+            print(np.array_equal(loaded.predict(x_train), y_pred))
+
+            # accuracy gap of histogram-binned training against exact mode
+            exact_mse = np.square(y_pred - y_train).mean()
+            for binning in [255, 16]:
+                gbr = MyGradientBoostingRegressor(n_estimators=n_estimators, max_depth=5, min_samples_split=2,
+                                                  binning=binning)
+                gbr.fit(x_train, y_train)
+                binned_mse = np.square(gbr.predict(x_train) - y_train).mean()
+                print("binning=%d: exact mse %.6g, binned mse %.6g, gap %.6g" %
+                      (binning, exact_mse, binned_mse, binned_mse - exact_mse))
+
+                # the same ensemble trained from the files, streamed a few rows at a time
+                streamed = MyGradientBoostingRegressor(n_estimators=n_estimators, max_depth=5, min_samples_split=2,
+                                                       binning=binning)
+                streamed.fit_from_files("Test_data" + os.sep + "x_" + str(i) + ".csv",
+                                        "Test_data" + os.sep + "y_" + str(i) + ".csv", chunk_rows=3)
+                print(operator.eq(streamed.get_model_string(), gbr.get_model_string()))
        
@@ -0,0 +1,297 @@
+import numpy as np
+import os
+import json
+import time
+import asyncio
+import collections
+from DecisionTreeRegressor import MyDecisionTreeRegressor
+from GradientBoostingRegressor import MyGradientBoostingRegressor
+
+REASONS = {200: b'OK', 400: b'Bad Request', 404: b'Not Found'}
+
+
+def percentiles(latencies, points=(50, 90, 99)):
+    '''
+    :param latencies: type: sequence of seconds
+    :return: dictionary of 'p50', 'p90', ... in milliseconds, empty if there are no latencies
+    '''
+    if len(latencies) == 0:
+        return {}
+    values = np.percentile(np.asarray(latencies) * 1000.0, points)
+    return {'p%g' % point: float(value) for point, value in zip(points, values)}
+
+
+class ModelServer(object):
+    def __init__(self, models, max_batch_rows=1024, max_delay=0.002, max_latencies=100000):
+        '''
+        Score requests against loaded models, coalescing concurrent requests
+        for the same model into one vectorized predict call.
+        :param models: type: dictionary of name to a fitted model with a predict(X) method
+        :param max_batch_rows: type: integer, a batch is scored as soon as it holds this many rows
+        :param max_delay: type: float, seconds the first request of a batch waits for
+        others to join it; with 0 only requests that are already queued are coalesced
+        :param max_latencies: type: integer, how many of the most recent request
+        latencies are kept for percentiles
+
+        min_features: type: dictionary, the least number of features a row
+        of every model must have; wider rows are cut to it, so requests of
+        any valid width can share a batch
+        queues, workers: the pending requests and the batching task of every
+        model that has been asked for, both created on its first request
+        '''
+        self.models = dict(models)
+        # the highest feature index a model splits on bounds the row width
+        self.min_features = {name: max(1, int(np.max(model.feature, initial=-1)) + 1)
+                             for name, model in self.models.items()}
+        self.max_batch_rows = max_batch_rows
+        self.max_delay = max_delay
+        self.latencies = collections.deque(maxlen=max_latencies)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.queues = {}
+        self.workers = {}
+
+    @classmethod
+    def from_files(cls, paths, **kwargs):
+        '''
+        :param paths: type: dictionary of name to a file written by save_model
+        of either regressor; the models are memory-mapped, see load_model
+        :return: a server holding the loaded models, kwargs as in __init__
+        '''
+        models = {}
+        for name, path in paths.items():
+            try:
+                models[name] = MyGradientBoostingRegressor.load_model(path)
+            except ValueError:
+                models[name] = MyDecisionTreeRegressor.load_model(path)
+        return cls(models, **kwargs)
+
+    async def score(self, name, rows):
+        '''
+        :param name: name of the model
+        :param rows: Feature data, type: array-like, shape: (n, num_feature) or (num_feature,)
+        :return: y_pred: Predicted label, type: numpy array, shape: (n,)
+        '''
+        if name not in self.models:
+            raise KeyError(name)
+        rows = np.atleast_2d(np.asarray(rows, dtype=float))
+        if rows.ndim != 2 or rows.shape[1] < self.min_features[name]:
+            raise ValueError("rows need at least %d features" % self.min_features[name])
+        # the model reads no column past min_features
+        rows = rows[:, :self.min_features[name]]
+        start = time.perf_counter()
+        if name not in self.queues:
+            self.queues[name] = asyncio.Queue()
+            self.workers[name] = asyncio.ensure_future(self.batch_worker(name))
+        future = asyncio.get_running_loop().create_future()
+        self.queues[name].put_nowait((rows, future))
+        y_pred = await future
+        self.latencies.append(time.perf_counter() - start)
+        return y_pred
+
+    async def batch_worker(self, name):
+        queue = self.queues[name]
+        model = self.models[name]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            while n_rows < self.max_batch_rows:
+                if queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = queue.get_nowait()
+                batch.append(item)
+                n_rows += len(item[0])
+            # predict off the event loop, so connections keep being served
+            try:
+                y_pred = await loop.run_in_executor(None, lambda: model.predict(
+                    np.concatenate([rows for rows, _ in batch])))
+            except Exception:
+                # score the requests one by one so only the bad ones fail
+                for rows, future in batch:
+                    try:
+                        result = await loop.run_in_executor(None, model.predict, rows)
+                    except Exception as error:
+                        result = error
+                    if not future.done():
+                        if isinstance(result, Exception):
+                            future.set_exception(result)
+                        else:
+                            future.set_result(result)
+                self.n_requests += len(batch)
+                self.n_batches += len(batch)
+                continue
+            self.n_requests += len(batch)
+            self.n_batches += 1
+            offset = 0
+            for rows, future in batch:
+                if not future.done():
+                    future.set_result(y_pred[offset:offset + len(rows)])
+                offset += len(rows)
+
+    def stats(self):
+        '''
+        :return: request and batch counts and latency percentiles in milliseconds
+        '''
+        return {'requests': self.n_requests, 'batches': self.n_batches,
+                'mean_batch_requests': self.n_requests / self.n_batches if self.n_batches else 0.0,
+                'latency_ms': percentiles(self.latencies)}
+
+    async def route(self, method, path, body):
+        '''
+        :return: status code and JSON payload of one HTTP request:
+        POST /predict/<name> with {"rows": [[...], ...]} answers {"predictions": [...]},
+        GET /stats answers stats()
+        '''
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats()
+        if method == 'POST' and path.startswith('/predict/'):
+            name = path[len('/predict/'):]
+            if name not in self.models:
+                return 404, {'error': 'unknown model %s' % name}
+            try:
+                y_pred = await self.score(name, json.loads(body.decode('utf-8'))['rows'])
+            except (ValueError, KeyError, TypeError, IndexError) as error:
+                return 400, {'error': str(error)}
+            return 200, {'predictions': y_pred.tolist()}
+        return 404, {'error': 'no route for %s %s' % (method, path)}
+
+    async def handle(self, reader, writer):
+        # one keep-alive HTTP/1.1 connection, requests answered in order
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self.route(method, path, body)
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' %
+                             (status, REASONS[status], len(data)) + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            # the client went away, sent a malformed request or the server is closing
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        '''
+        Serve HTTP on host and port, an ephemeral port by default, or on the Unix socket path.
+        :return: the asyncio server
+        '''
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        self.queues, self.workers = {}, {}
+
+
+async def generate_load(X, name, n_requests=1000, n_clients=32, rows_per_request=1, host='127.0.0.1', port=None,
+                        path=None):
+    '''
+    Synthetic load: n_clients keep-alive connections send n_requests scoring
+    requests between them, as fast as they are answered.
+    :param X: Feature data the request rows are taken from in order, wrapping around
+    :return: predictions of every request in request order, and their client-side latencies in seconds
+    '''
+    predictions = [None] * n_requests
+    latencies = np.zeros(n_requests)
+    next_request = iter(range(n_requests))
+
+    async def client():
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in next_request:
+                rows = X[np.arange(i * rows_per_request, (i + 1) * rows_per_request) % len(X)]
+                body = json.dumps({'rows': rows.tolist()}).encode('utf-8')
+                start = time.perf_counter()
+                writer.write(b'POST /predict/%s HTTP/1.1\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n' % (name.encode('utf-8'), len(body)) + body)
+                await writer.drain()
+                await reader.readline()
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    if key.strip().lower() == 'content-length':
+                        length = int(value)
+                response = json.loads((await reader.readexactly(length)).decode('utf-8'))
+                latencies[i] = time.perf_counter() - start
+                predictions[i] = np.array(response['predictions'])
+        finally:
+            writer.close()
+
+    await asyncio.gather(*[client() for _ in range(n_clients)])
+    return predictions, latencies
+
+
+# For test
+if __name__=='__main__':
+    x_train = np.genfromtxt("Test_data" + os.sep + "x_0.csv", delimiter=",")
+    y_train = np.genfromtxt("Test_data" + os.sep + "y_0.csv", delimiter=",")
+    gbr = MyGradientBoostingRegressor(n_estimators=20, max_depth=5, min_samples_split=2)
+    gbr.fit(x_train, y_train)
+    tree = MyDecisionTreeRegressor(max_depth=5, min_samples_split=2)
+    tree.fit(x_train, y_train)
+    n_requests = 2000
+
+    # one predict call per single-row request, the cost the server amortizes
+    start = time.perf_counter()
+    for i in range(n_requests):
+        gbr.predict(x_train[i % len(x_train)][np.newaxis])
+    print("unbatched: %.0f requests/s" % (n_requests / (time.perf_counter() - start)))
+
+    async def main():
+        server = ModelServer({'gbr': gbr, 'tree': tree})
+
+        # in-process callers, without the HTTP and JSON cost
+        start = time.perf_counter()
+        predictions = await asyncio.gather(*[server.score('gbr', x_train[i % len(x_train)])
+                                             for i in range(n_requests)])
+        elapsed = time.perf_counter() - start
+        print(np.array_equal(np.concatenate(predictions), gbr.predict(x_train[np.arange(n_requests) % len(x_train)])))
+        print("in-process: %.0f requests/s" % (n_requests / elapsed))
+
+        http = await server.start()
+        port = http.sockets[0].getsockname()[1]
+        for name, model in [('gbr', gbr), ('tree', tree)]:
+            start = time.perf_counter()
+            predictions, latencies = await generate_load(x_train, name, n_requests, port=port)
+            elapsed = time.perf_counter() - start
+            # batching must not change any prediction
+            expected = model.predict(x_train[np.arange(n_requests) % len(x_train)])
+            print(np.array_equal(np.concatenate(predictions), expected))
+            print("%s: %.0f requests/s, client latency ms %s" % (name, n_requests / elapsed, percentiles(latencies)))
+        print(server.stats())
+        http.close()
+        await http.wait_closed()
+        server.close()
+
+    asyncio.run(main())